@@ -1,21 +1,134 @@
 from helper_functions import *
+from functools import lru_cache
+from itertools import cycle
 from math import gcd
+import re
 
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional: the periodic ciphers then translate each column of the text separately
+    np = None
 
-def encrypt_caesar(text: str, shift: int, preserve_non_alphabetic_characters: bool = False) -> str:
-    """Encrypts text with the Caesar cipher, using the shift/key given"""
+# Number of translation tables kept by substitution_tables
+SUBSTITUTION_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=SUBSTITUTION_CACHE_SIZE)
+def substitution_tables(substitution: str) -> tuple[bytes, dict, bytes]:
+    """Returns the tables used by bytes.translate and str.translate to replace each letter (in upper or lower case) by
+    the corresponding letter of substitution, a string of 26 uppercase letters, and the one used on letter indexes"""
+    letters = string.ascii_uppercase + string.ascii_lowercase
+    bytes_table = bytes.maketrans(letters.encode(), (substitution * 2).encode())
+    index_table = substitution.encode().translate(LETTERS_TO_INDEXES) + bytes(230)
+    return bytes_table, str.maketrans(letters, substitution * 2), index_table
+
+
+def apply_substitution(text: str, substitution: str, preserve_non_alphabetic_characters: bool = False) -> str:
+    """Replaces each letter of text by the corresponding letter of substitution (a string of 26 uppercase letters)
+    in a single pass, like the loops of the monoalphabetic ciphers"""
+    bytes_table, str_table, index_table = substitution_tables(substitution)
+    if not preserve_non_alphabetic_characters:
+        return NormalizedText.from_letters(NormalizedText(text).letters.translate(index_table))
+    if isinstance(text, NormalizedText):
+        text = text.original_text
+    if text.isascii():
+        return text.encode().translate(bytes_table).decode()
+    check_letters(text)
+    return text.translate(str_table)
+
+
+def check_letters(text: str):
+    """Raises a ValueError if text contains letters other than A to Z (which can't be encrypted)"""
+    if not text.isascii():
+        for character in text:
+            if character.isalpha() and not character.isascii():
+                raise ValueError(f"invalid letter '{character}': only the letters A to Z can be encrypted")
+
+
+def letters_of(text: str, preserve_non_alphabetic_characters: bool) -> tuple[bytes, NormalizedText | None]:
+    """Returns the 0-based indexes of the letters of text, and the normalized text if its non-alphabetic characters
+    have to be put back (None otherwise)"""
+    text = NormalizedText(text)
     if not preserve_non_alphabetic_characters:
-        text = to_upper_case_without_punctuation_or_spaces(text)
+        return text.letters, None
+    check_letters(text.original_text)
+    if text.original_text.isascii():
+        return text.letters, text
+    return text.upper_case_bytes().translate(LETTERS_TO_INDEXES, NON_LETTER_BYTES), text
+
+
+def with_non_letters(letters: bytes, text: NormalizedText | None) -> str:
+    """Returns the letters (0-based indexes) put back in place of the letters of the original text in upper case,
+    or as a NormalizedText if text is None"""
+    if text is None:
+        return NormalizedText.from_letters(letters)
+    letters = letters.translate(INDEXES_TO_LETTERS)
+    upper_case_text = text.upper_case_bytes()
+    if np is not None:
+        result = np.frombuffer(upper_case_text, dtype=np.uint8).copy()
+        result[np.frombuffer(text.non_letter_mask(), dtype=np.uint8) == 0] = np.frombuffer(letters, dtype=np.uint8)
+        return result.tobytes().decode()
+    position = 0
+
+    def next_letters(match: re.Match) -> bytes:
+        nonlocal position
+        position += len(match[0])
+        return letters[position - len(match[0]) : position]
+
+    return re.sub(b"[A-Z]+", next_letters, upper_case_text).decode()
+
+
+def periodic_shift(letters: bytes, key: bytes, text_sign: int, key_sign: int) -> bytes:
+    """Returns (text_sign * letter + key_sign * key letter) % 26 for each letter, the key being repeated
+    (letters and key are 0-based letter indexes, and the signs are 1 or -1)"""
+    if not letters:
+        return letters
+    if not key:
+        raise ValueError("the key must contain at least one letter")
+    if np is None and len(key) * 64 > len(letters):
+        # Translating the columns is only worth it when they are long (a long key like the autokey one gives short ones)
+        return bytes(
+            (text_sign * letter + key_sign * key_letter) % 26 for letter, key_letter in zip(letters, cycle(key))
+        )
+    if np is None:
+        result = bytearray(len(letters))
+        for column, key_letter in enumerate(key):
+            table = bytes((text_sign * index + key_sign * key_letter) % 26 for index in range(26)) + bytes(230)
+            result[column :: len(key)] = letters[column :: len(key)].translate(table)
+        return bytes(result)
+
+    # The letters are kept as uint8 (a negative sign is applied as 26 - x), and the key is broadcast over the rows of
+    # key length letters, so that the whole computation is done in one pass without copying the key
+    letters_array = np.frombuffer(letters, dtype=np.uint8)
+    key_array = np.frombuffer(key, dtype=np.uint8)
+    if text_sign < 0:
+        letters_array = 26 - letters_array
+    if key_sign < 0:
+        key_array = 26 - key_array
+    result = np.empty(len(letters), dtype=np.uint8)
+    num_full_rows = len(letters) // len(key) * len(key)
+    np.add(
+        letters_array[:num_full_rows].reshape(-1, len(key)), key_array, out=result[:num_full_rows].reshape(-1, len(key))
+    )
+    np.add(letters_array[num_full_rows:], key_array[: len(letters) - num_full_rows], out=result[num_full_rows:])
+    np.remainder(result, 26, out=result)
+    return result.tobytes()
+
 
-    ciphertext_letters = []
-    for letter in text:
-        if not letter.isalpha():
-            ciphertext_letters.append(letter)
-            continue
-        letter = letter.upper()
-        ciphertext_letters.append(shift_letter(letter=letter, offset=shift))
+def apply_periodic_shift(
+    text: str, key: str, text_sign: int, key_sign: int, preserve_non_alphabetic_characters: bool = False
+) -> str:
+    """Encrypts or decrypts text with a periodic cipher: each letter x becomes text_sign * x + key_sign * k, where k is
+    the corresponding letter of the repeated key (only the letters count for the key position)"""
+    letters, normalized_text = letters_of(text, preserve_non_alphabetic_characters)
+    return with_non_letters(periodic_shift(letters, letter_indexes(key), text_sign, key_sign), normalized_text)
 
-    return "".join(ciphertext_letters)
+
+def encrypt_caesar(text: str, shift: int, preserve_non_alphabetic_characters: bool = False) -> str:
+    """Encrypts text with the Caesar cipher, using the shift/key given"""
+    return apply_substitution(
+        text, rotate_rotor(string.ascii_uppercase, shift % 26), preserve_non_alphabetic_characters
+    )
 
 
 def decrypt_caesar(text: str, shift: int, preserve_non_alphabetic_characters: bool = False) -> str:
@@ -27,72 +140,17 @@ def decrypt_caesar(text: str, shift: int, preserve_non_alphabetic_characters: bo
 
 def encrypt_vigenere(text: str, key: str, preserve_non_alphabetic_characters: bool = False) -> str:
     """Encrypts text with the Vigenere cipher, using the key given"""
-    if not preserve_non_alphabetic_characters:
-        text = to_upper_case_without_punctuation_or_spaces(text)
-    key = to_upper_case_without_punctuation_or_spaces(key)
-
-    ciphertext_letters = []
-    key_length = len(key)
-    index = 0
-    for letter in text:
-        if not letter.isalpha():
-            ciphertext_letters.append(letter)
-            continue
-        letter = letter.upper()
-        corresponding_key_letter = key[index % key_length]
-        encrypted_letter = shift_letter(letter, letter_index(corresponding_key_letter) - 1)
-        ciphertext_letters.append(encrypted_letter)
-
-        index += 1
-
-    return "".join(ciphertext_letters)
+    return apply_periodic_shift(text, key, 1, 1, preserve_non_alphabetic_characters)
 
 
 def decrypt_vigenere(text: str, key: str, preserve_non_alphabetic_characters: bool = False) -> str:
     """Decrypts text with the Vigenere cipher, using the key given"""
-    if not preserve_non_alphabetic_characters:
-        text = to_upper_case_without_punctuation_or_spaces(text)
-    key = to_upper_case_without_punctuation_or_spaces(key)
-
-    plain_text_letters = []
-    key_length = len(key)
-    index = 0
-    for letter in text:
-        if not letter.isalpha():
-            ciphertext_letters.append(letter)
-            continue
-        letter = letter.upper()
-        corresponding_key_letter = key[index % key_length]
-        decrypted_letter = shift_letter(letter, -letter_index(corresponding_key_letter) + 1)
-        plain_text_letters.append(decrypted_letter)
-
-        index += 1
-
-    return "".join(plain_text_letters)
+    return apply_periodic_shift(text, key, 1, -1, preserve_non_alphabetic_characters)
 
 
 def encrypt_beaufort(text: str, key: str, preserve_non_alphabetic_characters: bool = False) -> str:
     """Encrypts text with the Beaufort cipher, using the key given"""
-    if not preserve_non_alphabetic_characters:
-        text = to_upper_case_without_punctuation_or_spaces(text)
-    key = to_upper_case_without_punctuation_or_spaces(key)
-
-    ciphertext_letters = []
-    key_length = len(key)
-    index = 0
-    for letter in text:
-        if not letter.isalpha():
-            ciphertext_letters.append(letter)
-            continue
-        letter = letter.upper()
-        corresponding_key_letter = key[index % key_length]
-        text_letter_index = letter_index(letter)
-        encrypted_letter = shift_letter(corresponding_key_letter, -text_letter_index + 1)
-        ciphertext_letters.append(encrypted_letter)
-
-        index += 1
-
-    return "".join(ciphertext_letters)
+    return apply_periodic_shift(text, key, -1, 1, preserve_non_alphabetic_characters)
 
 
 def decrypt_beaufort(text: str, key: str, preserve_non_alphabetic_characters: bool = False) -> str:
@@ -100,32 +158,68 @@ def decrypt_beaufort(text: str, key: str, preserve_non_alphabetic_characters: bo
     return encrypt_beaufort(text, key, preserve_non_alphabetic_characters)
 
 
+class AutokeyCipher:
+    """A class used to encrypt or decrypt a text with the autokey cipher chunk by chunk, in linear time
+    Only the next key letters are kept: a queue of len(key) letters, initialised with the key, to which every
+    plaintext letter is added once it is known"""
+
+    def __init__(self, key: str, decrypt: bool = False, preserve_non_alphabetic_characters: bool = False):
+        """Parameters:
+        key: the key used
+
+        Optional:
+        decrypt: whether the chunks are decrypted instead of encrypted (defaults to False)
+        preserve_non_alphabetic_characters: whether the formatting of the chunks is kept (defaults to False)
+        """
+        self.running_key = letter_indexes(key)
+        if not self.running_key:
+            raise ValueError("the key must contain at least one letter")
+        self.decrypt = decrypt
+        self.preserve_non_alphabetic_characters = preserve_non_alphabetic_characters
+
+    def update(self, chunk: str) -> str:
+        """Encrypts or decrypts the next chunk of the text"""
+        letters, normalized_text = letters_of(chunk, self.preserve_non_alphabetic_characters)
+        key_length = len(self.running_key)
+        if not self.decrypt:
+            # The key of the chunk is the running key followed by the plaintext letters, known in advance
+            key = self.running_key + letters[: max(len(letters) - key_length, 0)]
+            result = periodic_shift(letters, key[: len(letters)], 1, 1)
+            self.running_key = (self.running_key + letters)[-key_length:]
+            return with_non_letters(result, normalized_text)
+
+        if np is None:
+            # Each plaintext letter replaces the key letter used to decrypt it in the ring buffer
+            ring_buffer = bytearray(self.running_key)
+            decrypted_letters = bytearray(len(letters))
+            position = 0
+            for index, letter in enumerate(letters):
+                decrypted_letters[index] = ring_buffer[position] = (letter - ring_buffer[position]) % 26
+                position = (position + 1) % key_length
+            self.running_key = bytes(ring_buffer[position:] + ring_buffer[:position])
+            return with_non_letters(bytes(decrypted_letters), normalized_text)
+
+        # In rows of len(key) letters, p[j] = c[j] - p[j - 1] with p[-1] the running key, which gives
+        # p[j] = (-1)^j * (c[0] - c[1] + ... + (-1)^j * c[j] - running key): an alternating cumulative sum of the rows
+        num_rows = -(-len(letters) // key_length)
+        rows = np.zeros(num_rows * key_length, dtype=np.int64)
+        rows[: len(letters)] = np.frombuffer(letters, dtype=np.uint8)
+        rows = rows.reshape(num_rows, key_length)
+        signs = np.where(np.arange(num_rows) % 2 == 0, 1, -1)[:, np.newaxis]
+        decrypted_rows = signs * (np.cumsum(signs * rows, axis=0) - np.frombuffer(self.running_key, dtype=np.uint8))
+        decrypted_letters = (decrypted_rows % 26).astype(np.uint8).tobytes()[: len(letters)]
+        self.running_key = (self.running_key + decrypted_letters)[-key_length:]
+        return with_non_letters(decrypted_letters, normalized_text)
+
+
 def encrypt_autokey(text: str, key: str, preserve_non_alphabetic_characters: bool = False) -> str:
     """Encrypts text with the autokey cipher, using the key given"""
-    return encrypt_vigenere(text, key + text, preserve_non_alphabetic_characters)
+    return AutokeyCipher(key, False, preserve_non_alphabetic_characters).update(text)
 
 
 def decrypt_autokey(text: str, key: str, preserve_non_alphabetic_characters: bool = False):
     """Decrypts text with the autokey cipher, using the key given"""
-    if not preserve_non_alphabetic_characters:
-        text = to_upper_case_without_punctuation_or_spaces(text)
-    key = to_upper_case_without_punctuation_or_spaces(key)
-
-    plain_text_letters = []
-    index = 0
-    for letter in text:
-        if not letter.isalpha():
-            ciphertext_letters.append(letter)
-            continue
-        letter = letter.upper()
-        corresponding_key_letter = key[index]
-        decrypted_letter = shift_letter(letter, -letter_index(corresponding_key_letter) + 1)
-        plain_text_letters.append(decrypted_letter)
-        key += decrypted_letter
-
-        index += 1
-
-    return "".join(plain_text_letters)
+    return AutokeyCipher(key, True, preserve_non_alphabetic_characters).update(text)
 
 
 def generate_affine_subsitution(a: int, b: int) -> dict:
@@ -143,34 +237,11 @@ def generate_affine_subsitution(a: int, b: int) -> dict:
 
 
 def encrypt_affine(text: str, a: int, b: int, preserve_non_alphabetic_characters: bool = False) -> str:
-    if not preserve_non_alphabetic_characters:
-        text = to_upper_case_without_punctuation_or_spaces(text)
-    substitution = generate_affine_subsitution(a, b)
-    ciphertext_letters = []
-    for letter in text:
-        if not letter.isalpha():
-            ciphertext_letters.append(letter)
-            continue
-
-        letter = letter.upper()
-        encrypted_letter = substitution[letter]
-        ciphertext_letters.append(encrypted_letter)
-
-    return "".join(ciphertext_letters)
+    substitution = "".join(generate_affine_subsitution(a, b).values())
+    return apply_substitution(text, substitution, preserve_non_alphabetic_characters)
 
 
 def decrypt_affine(text: str, a: int, b: int, preserve_non_alphabetic_characters: bool = False) -> str:
-    if not preserve_non_alphabetic_characters:
-        text = to_upper_case_without_punctuation_or_spaces(text)
-    substitution = {v: k for k, v in generate_affine_subsitution(a, b).items()}
-    plaintext_letters = []
-    for letter in text:
-        if not letter.isalpha():
-            ciphertext_letters.append(letter)
-            continue
-
-        letter = letter.upper()
-        decrypted_letter = substitution[letter]
-        plaintext_letters.append(decrypted_letter)
-
-    return "".join(plaintext_letters)
+    inverse_substitution = {v: k for k, v in generate_affine_subsitution(a, b).items()}
+    substitution = "".join(inverse_substitution[letter] for letter in string.ascii_uppercase)
+    return apply_substitution(text, substitution, preserve_non_alphabetic_characters)
@@ -8,124 +8,247 @@ from classical_ciphers import (
     decrypt_vigenere,
 )
 from index_of_coincidence import *
+from kasiski import kasiski_examination, kasiski_key_lengths
+from ngram_model import english_model, frequency_table, table_sum
 from helper_functions import *
+from collections import Counter
+from typing import NamedTuple
 from random import randrange
 import copy
+import math
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional: the columns are then counted separately
+    np = None
+
+# The frequencies of cryptanalysis_frequencies indexed by n-gram code (A=0, AA=0, AB=1...)
+LETTER_FREQUENCY_TABLE = frequency_table(LETTER_FRENQUENCIES)
+BIGRAM_FREQUENCY_TABLE = frequency_table(MOST_COMMON_BIGRAMS)
+TRIGRAM_FREQUENCY_TABLE = frequency_table(MOST_COMMON_TRIGRAMS)
+
+# Index of coincidence of English texts and of random texts, used by the Friedman test
+ENGLISH_INDEX_OF_COINCIDENCE = 0.0667
+RANDOM_INDEX_OF_COINCIDENCE = 1 / 26
+
+AFFINE_A_COEFFICIENTS = (1, 3, 5, 7, 9, 11, 15, 17, 19, 21, 23, 25)
+
+# Number of best keys compared with the n-gram model by break_caesar and break_affine
+REFINED_CANDIDATES = 3
+
+# Number of key lengths ranked by the Kasiski examination tried by break_vigenere when the key length isn't given
+KEY_LENGTH_CANDIDATES = 3
 
 
 def frequencies_score(text: str) -> float:
     """Returns a score measuring how 'English' letter frequencies are in a text"""
-    text = to_upper_case_without_punctuation_or_spaces(text)
-    score = 0
-    for letter in text:
-        score += LETTER_FRENQUENCIES[letter]
-    return score / len(text)
+    text = NormalizedText(text)
+    return table_sum(text.letters, LETTER_FREQUENCY_TABLE, 1) / len(text)
 
 
 def bigram_score(text: str) -> float:
     """Returns a score measuring how 'English' bigram frequencies are in a text"""
-    text = to_upper_case_without_punctuation_or_spaces(text)
-    score = 0
-    for index in range(len(text) - 1):
-        bigram = text[index] + text[index + 1]
-        score += MOST_COMMON_BIGRAMS.get(bigram, 0)
-    return score / len(text)
+    text = NormalizedText(text)
+    return table_sum(text.letters, BIGRAM_FREQUENCY_TABLE, 2) / len(text)
 
 
 def trigram_score(text: str) -> float:
     """Returns a score measuring how 'English' trigram frequencies are in a text"""
-    text = to_upper_case_without_punctuation_or_spaces(text)
-    score = 0
-    for index in range(len(text) - 2):
-        trigram = text[index] + text[index + 1] + text[index + 2]
-        score += MOST_COMMON_TRIGRAMS.get(trigram, 0)
-        return score / len(text)
+    text = NormalizedText(text)
+    return table_sum(text.letters, TRIGRAM_FREQUENCY_TABLE, 3) / len(text)
 
 
 def english_score(text: str) -> float:
-    """Returns a score meant to measure how 'English' is a text'"""
-    return frequencies_score(text) / 3 + bigram_score(text) * 3 + trigram_score(text) * 50
-
-
-def break_caesar(text: str) -> tuple:
-    """Takes a ciphertext encrypted with the Caesar cipher and returns the most probable key"""
-    best_text = ""
-    best_key = 0
-    best_score = 0
-    for key in range(1, 26):
-        decrypted_text = decrypt_caesar(text, key)
-        corresponding_score = english_score(decrypted_text)
-        if corresponding_score > best_score:
-            best_score = corresponding_score
-            best_text = decrypted_text
-            best_key = key
-    return best_key
-
-
-def break_affine(text: str) -> tuple:
-    """Takes a ciphertext encrypted with the affine cipher and returns (the most probable a coefficient, the corresponding b coefficient)"""
-    best_text = ""
-    best_a = 0
-    best_b = 0
-    best_score = 0
-    for a in (1, 3, 5, 7, 9, 11, 15, 17, 19, 21, 23, 25):
+    """Returns a score meant to measure how 'English' is a text: the mean log10 probability of its n-grams under the
+    English model (see english_model)"""
+    return english_model().score(text)
+
+
+def letter_counts(text: str) -> list[int]:
+    """Returns the number of occurrences of each letter (A to Z) in a text"""
+    letters = NormalizedText(text).letters
+    return [letters.count(index) for index in range(26)]
+
+
+def letter_log_probabilities() -> list[float]:
+    """Returns the log10 probabilities of the letters (A to Z) under the English model"""
+    return [float(log_probability) for log_probability in english_model().table(1)]
+
+
+def histogram_log_likelihood(counts: list[int], decryption: list[int], log_probabilities: list[float]) -> float:
+    """Returns the log-likelihood, under the letter log probabilities given, of the text decrypted by replacing each
+    letter index by decryption[index], computed from the letter counts of the ciphertext only"""
+    return sum(count * log_probabilities[decryption[index]] for index, count in enumerate(counts) if count)
+
+
+def refine_with_ngrams(text: str, ranked_keys: list[tuple[float, object]], decrypt, num_refined_candidates: int):
+    """Returns the key, among the num_refined_candidates best ranked ones, giving the most English decryption according
+    to the n-gram model (or the best ranked key if num_refined_candidates is 0)"""
+    if num_refined_candidates <= 1:
+        return ranked_keys[0][1]
+    candidates = ranked_keys[:num_refined_candidates]
+    return max(candidates, key=lambda candidate: english_score(decrypt(text, candidate[1])))[1]
+
+
+def rank_caesar_keys(text: str) -> list[tuple[float, int]]:
+    """Returns the (log-likelihood, key) of every key of the Caesar cipher for a ciphertext, most probable first"""
+    counts = letter_counts(text)
+    log_probabilities = letter_log_probabilities()
+    ranked_keys = [
+        (histogram_log_likelihood(counts, [(index - key) % 26 for index in range(26)], log_probabilities), key)
+        for key in range(1, 26)
+    ]
+    return sorted(ranked_keys, reverse=True)
+
+
+def break_caesar(text: str, num_refined_candidates: int = REFINED_CANDIDATES) -> int:
+    """Takes a ciphertext encrypted with the Caesar cipher and returns the most probable key
+    The keys are ranked from the letter counts only, then the best ones are compared with the n-gram model"""
+    text = NormalizedText(text)
+    if not text:
+        return 0
+    return refine_with_ngrams(text, rank_caesar_keys(text), decrypt_caesar, num_refined_candidates)
+
+
+def rank_affine_keys(text: str) -> list[tuple[float, tuple[int, int]]]:
+    """Returns the (log-likelihood, (a, b)) of every key of the affine cipher for a ciphertext, most probable first"""
+    counts = letter_counts(text)
+    log_probabilities = letter_log_probabilities()
+    ranked_keys = []
+    for a in AFFINE_A_COEFFICIENTS:
+        inverse_a = pow(a, -1, 26)
         for b in range(0, 26):
-            decrypted_text = decrypt_affine(text, a, b)
-            corresponding_score = english_score(decrypted_text)
-            if corresponding_score > best_score:
-                best_score = corresponding_score
-                best_text = decrypted_text
-                best_a = a
-                best_b = b
-    return (best_a, best_b)
+            decryption = [inverse_a * (index - b) % 26 for index in range(26)]
+            ranked_keys.append((histogram_log_likelihood(counts, decryption, log_probabilities), (a, b)))
+    return sorted(ranked_keys, reverse=True)
+
+
+def break_affine(text: str, num_refined_candidates: int = REFINED_CANDIDATES) -> tuple:
+    """Takes a ciphertext encrypted with the affine cipher and returns (the most probable a coefficient, the corresponding b coefficient)
+    The keys are ranked from the letter counts only, then the best ones are compared with the n-gram model"""
+    text = NormalizedText(text)
+    if not text:
+        return (0, 0)
+    return refine_with_ngrams(
+        text, rank_affine_keys(text), lambda text, key: decrypt_affine(text, *key), num_refined_candidates
+    )
+
+
+class KeyLengthAnalysis(NamedTuple):
+    """The candidate key lengths of a Vigenere ciphertext ranked by several estimators, as (key length, score) pairs,
+    the most probable first"""
+
+    mean_column_ioc: list[tuple[int, float]]  # mean index of coincidence of the columns (highest first)
+    friedman: list[tuple[int, float]]  # distance to the Friedman estimate (closest first)
+    kasiski: list[tuple[int, float]]  # spacings of repeated trigrams multiple of the length, compared to chance
+    friedman_estimate: float  # key length estimated from the index of coincidence of the whole text
+
+
+def column_histograms(letters: bytes, lengths):
+    """Yields, for each length, the letter counts of each column of a text written in rows of length letters
+    (letters are 0-based indexes)"""
+    if np is not None:
+        positions = np.arange(len(letters), dtype=np.int32)
+        letters_array = np.frombuffer(letters, dtype=np.uint8).astype(np.int32)
+        codes = np.empty(len(letters), dtype=np.int32)
+        for length in lengths:
+            np.remainder(positions, length, out=codes)
+            codes *= 26
+            codes += letters_array
+            yield np.bincount(codes, minlength=length * 26).reshape(length, 26).tolist()
+        return
+    for length in lengths:
+        histograms = []
+        for column in range(length):
+            counts = Counter(letters[column::length])
+            histograms.append([counts[index] for index in range(26)])
+        yield histograms
+
+
+def analyse_key_length(text: str, min_len: int = 2, max_len: int = 8) -> KeyLengthAnalysis:
+    """Takes a ciphertext encrypted with the Vigenere cipher and ranks the key lengths within the interval specified
+    with the mean index of coincidence of the columns, the Friedman test and the Kasiski examination"""
+    letters = NormalizedText(text).letters
+    lengths = range(min_len, max_len + 1)
+
+    mean_column_ioc = []
+    for length, histograms in zip(lengths, column_histograms(letters, lengths)):
+        column_iocs = [index_of_coincidence_from_counts(counts) for counts in histograms if sum(counts) > 1]
+        mean_column_ioc.append((length, sum(column_iocs) / length))
+
+    # Friedman test: the index of coincidence of the text is a mix of the English one and the random one
+    friedman_estimate = 0.0
+    if len(letters) > 1:
+        text_ioc = index_of_coincidence_from_counts([letters.count(index) for index in range(26)])
+        if text_ioc > RANDOM_INDEX_OF_COINCIDENCE:
+            friedman_estimate = (ENGLISH_INDEX_OF_COINCIDENCE - RANDOM_INDEX_OF_COINCIDENCE) / (
+                text_ioc - RANDOM_INDEX_OF_COINCIDENCE
+            )
+        else:
+            friedman_estimate = math.inf
+    friedman = [(length, abs(length - friedman_estimate)) for length in lengths]
+
+    # Kasiski examination: the spacings of repeated trigrams are mostly multiples of the key length
+    kasiski = kasiski_examination(text, min_len, max_len, num_most_repeated=0).key_lengths
+
+    return KeyLengthAnalysis(
+        sorted(mean_column_ioc, key=lambda candidate: -candidate[1]),
+        sorted(friedman, key=lambda candidate: candidate[1]),
+        kasiski,
+        friedman_estimate,
+    )
 
 
 def key_length(text: str, min_len: int = 2, max_len: int = 8) -> int:
     """Takes a ciphertext encrypted with the Vigenere cipher and returns the most probable key length used within the interval specified"""
-    text = to_upper_case_without_punctuation_or_spaces(text)
-    best_key_length = 0
-    best_IoC = 0
-    for length in range(min_len, max_len + 1):
-        slices = [""] * length
-        for index in range(len(text)):
-            letter = text[index]
-            slices[index % length] += letter
-
-        slices_IoC = []
-        for single_slice in slices:
-            if len(single_slice) > 1:
-                slices_IoC.append(index_of_coincidence(single_slice))
-        IoC_mean = sum(slices_IoC) / length
-
-        if IoC_mean > best_IoC:
-            best_IoC = IoC_mean
-            best_key_length = length
+    best_key_length, best_IoC = analyse_key_length(text, min_len, max_len).mean_column_ioc[0]
+    if best_IoC == 0:
+        return 0
     return best_key_length
 
 
 def find_offset(text: str) -> int:
-    """Helper function for decrypting Vigenere cipher"""
-    best_text = ""
-    best_key = 0
-    best_score = 0
-    for key in range(1, 26):
-        decrypted_text = decrypt_caesar(text, key)
-        corresponding_score = frequencies_score(decrypted_text)
-        if corresponding_score > best_score:
-            best_score = corresponding_score
-            best_text = decrypted_text
-            best_key = key
-    return best_key
-
-
-def break_vigenere(text: str, key_length: int) -> str:
-    """Takes a ciphertext encrypted with the Vigenere cipher encrypted with a key of length key_length and returns the most probable key"""
-    text = to_upper_case_without_punctuation_or_spaces(text)
+    """Helper function for decrypting Vigenere cipher: returns the shift (0 to 25) of a column of the ciphertext whose
+    decryption has the most English letter counts"""
+    counts = letter_counts(text)
+    log_probabilities = letter_log_probabilities()
+    return max(
+        range(26),
+        key=lambda key: histogram_log_likelihood(
+            counts, [(index - key) % 26 for index in range(26)], log_probabilities
+        ),
+    )
+
+
+def minimal_period(key: str) -> str:
+    """Returns the shortest key whose repetition gives key (ex: ABCABC -> ABC)"""
+    for length in range(1, len(key)):
+        if len(key) % length == 0 and key[:length] * (len(key) // length) == key:
+            return key[:length]
+    return key
+
+
+def break_vigenere(
+    text: str, key_length: int = None, min_len: int = 2, max_len: int = 20, num_key_lengths: int = KEY_LENGTH_CANDIDATES
+) -> str:
+    """Takes a ciphertext encrypted with the Vigenere cipher encrypted with a key of length key_length and returns the most probable key
+    If key_length isn't given, the num_key_lengths key lengths within the interval specified ranked first by the
+    Kasiski examination (or the most probable one by the index of coincidence if no trigram is repeated) are tried,
+    and the key giving the most English decryption is returned"""
+    text = NormalizedText(text)
+    if key_length is None and not text:
+        return ""
+    if key_length is None:
+        key_lengths = kasiski_key_lengths(text, min_len, max_len)[:num_key_lengths]
+        if not key_lengths:
+            key_lengths = [analyse_key_length(text, min_len, max_len).mean_column_ioc[0][0]]
+        keys = {minimal_period(break_vigenere(text, length)) for length in key_lengths}
+        # The shortest key wins on ties: a multiple of the key length gives the same decryption
+        keys = sorted(keys, key=lambda key: (len(key), key))
+        return max(keys, key=lambda key: english_score(decrypt_vigenere(text, key)))
     key = ""
     for key_letter_index in range(key_length):
-        corresponding_slice = []
-        for index in range(key_letter_index, len(text), key_length):
-            corresponding_slice.append(text[index])
-        key_letter_found = letter_from_index(find_offset("".join(corresponding_slice)) + 1)
+        corresponding_slice = NormalizedText.from_letters(text.letters[key_letter_index::key_length])
+        key_letter_found = letter_from_index(find_offset(corresponding_slice) + 1)
         key += key_letter_found
     return key
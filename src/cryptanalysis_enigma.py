@@ -0,0 +1,685 @@
+from enigma_machine import (
+    Enigma,
+    EnigmaI,
+    TRANSLATION_TABLE_PADDING,
+    inner_substitution,
+    stepping_segments,
+    substitution_sequence,
+)
+from ngram_model import english_model
+from index_of_coincidence import index_of_coincidence
+from helper_functions import *
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import Counter
+from array import array
+import itertools
+import hashlib
+import copy
+import heapq
+import math
+import json
+import time
+import os
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional: the legal crib positions are then listed one by one
+    np = None
+
+# For each letter, a translation table giving "1" for this letter and "0" for the other ones
+LETTER_MASK_TABLES = [
+    bytes.maketrans(
+        string.ascii_uppercase.encode(),
+        "".join("1" if other == letter else "0" for other in string.ascii_uppercase).encode(),
+    )
+    for letter in string.ascii_uppercase
+]
+# Translation table converting the characters "0" and "1" to the bytes 0 and 1
+BITS_TO_FLAGS = bytes.maketrans(b"01", b"\x00\x01")
+
+
+def build_menu(ciphertext: str, crib: str, crib_position: int = 0) -> list[tuple[int, int, int]]:
+    """Returns the menu of a crib placed at crib_position in the ciphertext, as a list of
+    (plaintext letter index, ciphertext letter index, offset in the crib) with A=0"""
+    ciphertext = to_upper_case_without_punctuation_or_spaces(ciphertext)
+    crib = to_upper_case_without_punctuation_or_spaces(crib)
+    if crib_position + len(crib) > len(ciphertext):
+        raise ValueError("the crib doesn't fit in the ciphertext at this position")
+
+    menu = []
+    for offset, (plaintext_letter, ciphertext_letter) in enumerate(zip(crib, ciphertext[crib_position:])):
+        if plaintext_letter == ciphertext_letter:
+            raise ValueError("invalid crib position: Enigma never encrypts a letter to itself")
+        menu.append((letter_index(plaintext_letter) - 1, letter_index(ciphertext_letter) - 1, offset))
+    return menu
+
+
+def letter_position_masks(ciphertext: str) -> list[int]:
+    """Returns, for each letter, an integer whose bit i is set when the letter is at the position i of the ciphertext"""
+    ciphertext = to_upper_case_without_punctuation_or_spaces(ciphertext).encode()
+    masks = []
+    for letter_mask_table in LETTER_MASK_TABLES:
+        # The bits are written from the last position to the first one, so that the first position is the lowest bit
+        bits = ciphertext[::-1].translate(letter_mask_table)
+        masks.append(int(bits, 2) if bits else 0)
+    return masks
+
+
+def legal_crib_positions(ciphertext: str, cribs: list[str]):
+    """Yields, for each crib, (crib, array of every position of the ciphertext where it can be placed), the array being
+    a NumPy array if NumPy is installed: Enigma never encrypts a letter to itself, so a crib can't be placed where one
+    of its letters is in front of the same letter
+    All the positions are tested at once by comparing bit masks, and the cribs are handled one at a time to keep the
+    memory used low with long ciphertexts and many cribs"""
+    ciphertext = to_upper_case_without_punctuation_or_spaces(ciphertext)
+    masks = letter_position_masks(ciphertext)
+    for crib in cribs:
+        normalized_crib = to_upper_case_without_punctuation_or_spaces(crib)
+        num_positions = len(ciphertext) - len(normalized_crib) + 1
+        if num_positions <= 0:
+            yield crib, np.zeros(0, dtype=np.intp) if np is not None else array("I")
+            continue
+
+        # The bit i of conflicts is set when the crib placed at position i has a letter in front of the same letter
+        conflicts = 0
+        for offset, letter in enumerate(normalized_crib):
+            conflicts |= masks[letter_index(letter) - 1] >> offset
+        legal_positions_mask = ~conflicts & ((1 << num_positions) - 1)
+
+        flags = format(legal_positions_mask, f"0{num_positions}b")[::-1].encode().translate(BITS_TO_FLAGS)
+        if np is not None:
+            yield crib, np.flatnonzero(np.frombuffer(flags, dtype=np.uint8))
+        else:
+            yield crib, array("I", itertools.compress(range(num_positions), flags))
+
+
+def menu_links(menu: list[tuple[int, int, int]], scrambler_substitutions: list[bytes]) -> list[list[tuple]]:
+    """Returns, for each letter, the (other letter, scrambler substitution) pairs it is linked to in the menu"""
+    links = [[] for _ in range(26)]
+    for plaintext_letter, ciphertext_letter, offset in menu:
+        substitution = scrambler_substitutions[offset]
+        links[plaintext_letter].append((ciphertext_letter, substitution))
+        links[ciphertext_letter].append((plaintext_letter, substitution))
+    return links
+
+
+def bombe_closure(links: list[list[tuple]], test_letter: int, value: int) -> bytearray:
+    """Returns the 26x26 live wires (letter * 26 + steckered letter) implied by the hypothesis that test_letter is
+    steckered to value, the way the current spread in the bombe through the scramblers and the diagonal board
+    The propagation stops early once every wire of the test letter is live"""
+    live_wires = bytearray(26 * 26)
+    live_wires[test_letter * 26 + value] = 1
+    num_live_test_wires = 1
+    wires_to_visit = [(test_letter, value)]
+    while wires_to_visit:
+        letter, steckered_letter = wires_to_visit.pop()
+        # The diagonal board connects the wire (a, b) to the wire (b, a)
+        connected_wires = [(steckered_letter, letter)]
+        for other_letter, substitution in links[letter]:
+            connected_wires.append((other_letter, substitution[steckered_letter]))
+
+        for connected_wire in connected_wires:
+            wire = connected_wire[0] * 26 + connected_wire[1]
+            if live_wires[wire]:
+                continue
+            live_wires[wire] = 1
+            wires_to_visit.append(connected_wire)
+            if connected_wire[0] == test_letter:
+                num_live_test_wires += 1
+                if num_live_test_wires == 26:
+                    return live_wires
+    return live_wires
+
+
+def plugboard_from_closure(live_wires: bytearray) -> dict | None:
+    """Returns the plugboard connections given by the live wires, or None if a letter is steckered to several ones"""
+    plugboard = {}
+    for letter in range(26):
+        steckered_letters = [value for value in range(26) if live_wires[letter * 26 + value]]
+        if len(steckered_letters) > 1:
+            return None
+        if len(steckered_letters) == 1 and steckered_letters[0] > letter:
+            plugboard[letter_from_index(letter + 1)] = letter_from_index(steckered_letters[0] + 1)
+    return plugboard
+
+
+def bombe_stops(links: list[list[tuple]], test_letter: int) -> list[dict]:
+    """Returns the plugboard hypotheses consistent with the menu for a scrambler position (the bombe stops)"""
+    stops = []
+    untested_values = set(range(26))
+    while untested_values:
+        value = min(untested_values)
+        live_wires = bombe_closure(links, test_letter, value)
+        live_test_values = {other_value for other_value in range(26) if live_wires[test_letter * 26 + other_value]}
+        # Every hypothesis implied by a false one is false as well
+        untested_values -= live_test_values
+        if len(live_test_values) == 1:
+            plugboard = plugboard_from_closure(live_wires)
+            if plugboard is not None:
+                stops.append(plugboard)
+    return stops
+
+
+def search_rotor_order(
+    machine_class, rotor_order: tuple, reflector: str, ring_settings, menu: list, crib_position: int
+) -> list[tuple]:
+    """Runs the bombe over the 17,576 starting positions of a rotor order, and returns the stops found as
+    (rotor order, starting positions, plugboard) tuples"""
+    machine = machine_class(list(rotor_order), ring_settings, {}, reflector=reflector)
+    crib_length = max(offset for _, _, offset in menu) + 1
+    test_letter = Counter(letter for link in menu for letter in link[:2]).most_common(1)[0][0]
+
+    stops = []
+    for starting_positions in itertools.product(string.ascii_uppercase, repeat=3):
+        machine.seek(crib_position, starting_positions)
+        sequence = substitution_sequence(machine, tuple(machine.rotor_positions), crib_length)
+        scrambler_substitutions = [sequence[offset : offset + 26] for offset in range(0, len(sequence), 26)]
+        for plugboard in bombe_stops(menu_links(menu, scrambler_substitutions), test_letter):
+            stops.append((rotor_order, "".join(starting_positions), plugboard))
+    return stops
+
+
+def attack_fingerprint(**inputs) -> str:
+    """Returns a hash identifying the inputs of an attack, stored in its checkpoint or log so that they aren't resumed
+    by an attack on other inputs"""
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def load_checkpoint(checkpoint_file: str, fingerprint: str) -> dict:
+    """Loads the results of the rotor orders already searched (an empty checkpoint if the file doesn't exist)"""
+    if checkpoint_file is None or not os.path.exists(checkpoint_file):
+        return {}
+    with open(checkpoint_file) as file:
+        checkpoint = json.load(file)
+    if not isinstance(checkpoint, dict) or checkpoint.get("fingerprint") != fingerprint:
+        raise ValueError("the checkpoint file was written by an attack on other inputs")
+    return {tuple(entry["rotor_order"]): entry["stops"] for entry in checkpoint["rotor_orders"]}
+
+
+def save_checkpoint(checkpoint_file: str, results: dict, fingerprint: str):
+    """Saves the results of the rotor orders already searched (the file is replaced atomically)"""
+    entries = [{"rotor_order": list(rotor_order), "stops": stops} for rotor_order, stops in results.items()]
+    temporary_file = checkpoint_file + ".tmp"
+    with open(temporary_file, "w") as file:
+        json.dump({"fingerprint": fingerprint, "rotor_orders": entries}, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_file, checkpoint_file)
+
+
+def bombe_attack(
+    ciphertext: str,
+    crib: str,
+    crib_position: int = 0,
+    machine_class=EnigmaI,
+    reflector: str = "B",
+    ring_settings="AAA",
+    max_workers: int = None,
+    checkpoint_file: str = None,
+    progress=None,
+) -> list[tuple]:
+    """Takes an Enigma ciphertext and a crib (known plaintext) placed at crib_position, and returns the settings
+    consistent with it as (rotor order, starting positions, plugboard) tuples, the way the Turing bombe did
+    Each rotor order is searched by a pool of processes
+
+    Optional:
+    machine_class: the Enigma model (with 3 rotors) whose rotors are tried (defaults to EnigmaI)
+    reflector: the reflector used (defaults to B)
+    ring_settings: the ring settings assumed (like the bombe, only the turnover of the middle rotor depends on them)
+    max_workers: the number of processes used
+    checkpoint_file: a JSON file where the results are saved after each rotor order, to resume an interrupted search
+    progress: a function called with (number of rotor orders searched, total number of rotor orders)
+    """
+    menu = build_menu(ciphertext, crib, crib_position)
+    rotor_orders = list(itertools.permutations(machine_class.ROTORS, 3))
+    fingerprint = attack_fingerprint(
+        attack="bombe",
+        ciphertext=to_upper_case_without_punctuation_or_spaces(ciphertext),
+        crib=to_upper_case_without_punctuation_or_spaces(crib),
+        crib_position=crib_position,
+        machine_class=machine_class.__name__,
+        reflector=reflector,
+        ring_settings=list(ring_settings),
+    )
+    results = load_checkpoint(checkpoint_file, fingerprint)
+    rotor_orders_to_search = [rotor_order for rotor_order in rotor_orders if rotor_order not in results]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                search_rotor_order, machine_class, rotor_order, reflector, ring_settings, menu, crib_position
+            ): rotor_order
+            for rotor_order in rotor_orders_to_search
+        }
+        for future in as_completed(futures):
+            stops = future.result()
+            results[futures[future]] = [[starting_positions, plugboard] for _, starting_positions, plugboard in stops]
+            if checkpoint_file is not None:
+                save_checkpoint(checkpoint_file, results, fingerprint)
+            if progress is not None:
+                progress(len(results), len(rotor_orders))
+
+    return [
+        (rotor_order, starting_positions, plugboard)
+        for rotor_order in rotor_orders
+        for starting_positions, plugboard in results[rotor_order]
+    ]
+
+
+def shift_letters(letters: str, shifts: list[int]) -> str:
+    """Shifts each letter by the corresponding shift"""
+    return "".join(shift_letter(letter, shift) for letter, shift in zip(letters, shifts))
+
+
+def search_positions_by_ioc(
+    machine_class, rotor_order: tuple, reflector: str, ciphertext: str, num_candidates: int, deadline: float
+) -> tuple[bool, list]:
+    """Phase 1 of the ciphertext-only attack: tries every starting position of a rotor order (with the rings at A and
+    without plugboard), and returns (whether the search is complete, the num_candidates best candidates) where the
+    candidates are (index of coincidence, rotor order, ring settings, starting positions, plugboard)"""
+    machine = machine_class(list(rotor_order), "AAA", {}, reflector=reflector)
+    best_candidates = []
+    for number, starting_positions in enumerate(itertools.product(string.ascii_uppercase, repeat=3)):
+        if number % 676 == 0 and deadline is not None and time.time() > deadline:
+            return False, sorted(best_candidates, reverse=True)
+        score = index_of_coincidence(machine.decrypt(ciphertext, starting_positions))
+        candidate = (score, rotor_order, "AAA", "".join(starting_positions), {})
+        if len(best_candidates) < num_candidates:
+            heapq.heappush(best_candidates, candidate)
+        elif score > best_candidates[0][0]:
+            heapq.heapreplace(best_candidates, candidate)
+    return True, sorted(best_candidates, reverse=True)
+
+
+class TurnoverSegments:
+    """A class used to decrypt a ciphertext quickly while sweeping the ring settings of the right and middle rotors
+    Turning a ring and the corresponding starting position together only changes when the next rotor steps, so the
+    substitutions of the right rotor are the same for every ring setting and are computed once. Between two steps of
+    the middle rotor, the part done by the middle and left rotors and the reflector is constant: the decryption of the
+    whole text with each of these parts is computed once, and a decryption is made of slices of them"""
+
+    def __init__(self, machine: Enigma, ciphertext: str, starting_positions=None):
+        """Parameters:
+        machine: the Enigma machine (it isn't modified)
+        ciphertext: the text to decrypt
+
+        Optional:
+        starting_positions: the rotor starting positions (defaults to the ones of the machine)
+        """
+        self.machine = machine
+        if starting_positions is not None:
+            self.rotor_positions = machine.convert_positions(starting_positions)
+        else:
+            self.rotor_positions = list(machine.starting_positions)
+        self.static_reflector_table = machine.static_reflector_table(self.rotor_positions)
+
+        ciphertext = letter_indexes(ciphertext)
+        self.length = len(ciphertext)
+        # The right rotor is at the position first_right_position + i + 1 when the letter i is encrypted
+        self.first_right_position = self.rotor_positions[0] - 1
+        self.right_positions = [(self.first_right_position + offset + 1) % 26 for offset in range(26)]
+        # Letters leaving the right rotor on the way in, and the exit tables of the letters (every 26 letters)
+        self.middle_letters = self.by_residue(
+            ciphertext, [machine.entry_tables[position] for position in self.right_positions]
+        )
+        self.exit_tables = [
+            machine.exit_tables[position] + TRANSLATION_TABLE_PADDING for position in self.right_positions
+        ]
+        self.decryptions = {}
+
+    def by_residue(self, indexes: bytes, tables: list[bytes]) -> bytes:
+        """Translates the letter i of indexes with tables[i % 26]"""
+        result = bytearray(len(indexes))
+        for residue, table in enumerate(tables):
+            result[residue::26] = indexes[residue::26].translate(table + TRANSLATION_TABLE_PADDING[: 256 - len(table)])
+        return bytes(result)
+
+    def decryption(self, middle_position: int, left_position: int) -> bytes:
+        """Returns the decryption of the whole text with the middle and left rotors at the given 0-based positions"""
+        key = (middle_position, left_position)
+        if key not in self.decryptions:
+            inner_table = inner_substitution(self.machine, middle_position, left_position, self.static_reflector_table)
+            letters = self.middle_letters.translate(inner_table)
+            self.decryptions[key] = self.by_residue(letters, self.exit_tables)
+        return self.decryptions[key]
+
+    def segments(self, right_shift: int, middle_shift: int) -> list[tuple[int, int, int, int]]:
+        """Returns the (start, end, middle position, left position) segments of letters during which the middle and left
+        rotors don't move, when the right and middle rotors are shifted (both their ring settings and positions)"""
+        right_turnover, middle_turnover, _ = self.machine.turnover_tables[:3]
+        # The shifted middle rotor reaches its notch positions middle_shift steps earlier, the shifted right rotor only
+        # starts at another position
+        shifted_middle_turnover = middle_turnover[middle_shift:] + middle_turnover[:middle_shift]
+        rotor_positions = (
+            self.first_right_position + right_shift,
+            self.rotor_positions[1] - 1,
+            self.rotor_positions[2] - 1,
+        )
+        return list(stepping_segments((right_turnover, shifted_middle_turnover), rotor_positions, self.length))
+
+    def decrypt(self, right_shift: int = 0, middle_shift: int = 0) -> str:
+        """Returns the decrypted text when both the ring setting and starting position of the right rotor are shifted
+        by right_shift, and those of the middle rotor by middle_shift"""
+        decrypted_indexes = b"".join(
+            self.decryption(middle_position, left_position)[start:end]
+            for start, end, middle_position, left_position in self.segments(right_shift, middle_shift)
+        )
+        return decrypted_indexes.translate(INDEXES_TO_LETTERS).decode()
+
+
+def search_ring_settings(
+    machine_class, candidate: tuple, reflector: str, ciphertext: str, num_candidates: int, deadline: float
+) -> tuple[bool, list]:
+    """Phase 2 of the ciphertext-only attack: finds the ring settings of the right rotor, then of the middle one
+    (the left ring doesn't change the stepping, so it stays at A)"""
+    score, rotor_order, ring_settings, starting_positions, plugboard = candidate
+    machine = machine_class(list(rotor_order), ring_settings, plugboard, reflector=reflector)
+    segments = TurnoverSegments(machine, ciphertext, starting_positions)
+
+    best_shifts = [0, 0, 0]
+    for rotor_index in (2, 1):
+        shifts = list(best_shifts)
+        for shift in range(1, 26):
+            if deadline is not None and time.time() > deadline:
+                break
+            shifts[rotor_index] = shift
+            new_score = index_of_coincidence(segments.decrypt(right_shift=shifts[2], middle_shift=shifts[1]))
+            if new_score > score:
+                score = new_score
+                best_shifts = list(shifts)
+
+    best_candidate = (
+        score,
+        rotor_order,
+        shift_letters(ring_settings, best_shifts),
+        shift_letters(starting_positions, best_shifts),
+        plugboard,
+    )
+    return deadline is None or time.time() <= deadline, [best_candidate]
+
+
+class PlugboardOptimizer:
+    """A class used to hill-climb the plugboard of an Enigma machine whose other settings are known
+    The substitutions done by the rotors and reflector at each position are computed once, so that changing a plugboard
+    connection only decrypts again the letters it affects and scores again the n-grams containing them"""
+
+    def __init__(self, machine: Enigma, ciphertext: str, starting_positions=None, ngram_length: int = 2, model=None):
+        """Parameters:
+        machine: the Enigma machine (its plugboard is the starting point of the hill-climbing, it isn't modified)
+        ciphertext: the text to decrypt
+
+        Optional:
+        starting_positions: the rotor starting positions (defaults to the ones of the machine)
+        ngram_length: the length of the n-grams scored (defaults to bigrams)
+        model: the NgramModel giving the scores of the n-grams, their log10 probabilities (defaults to english_model())
+        """
+        if model is None:
+            model = english_model()
+        self.ngram_length = ngram_length
+        # The table of the model is indexed by the n-gram code (with A=0, AA=0, AB=1...), it is copied in a list of
+        # floats which are faster to look up one by one
+        self.ngram_scores = model.table(ngram_length).tolist()
+
+        plugboard = machine.plugboard
+        scrambler = copy.copy(machine)
+        scrambler.set_plugboard({})
+        scrambler.initialise_rotors(starting_positions)
+
+        self.ciphertext = list(letter_indexes(ciphertext))
+        sequence = substitution_sequence(scrambler, tuple(scrambler.rotor_positions), len(self.ciphertext))
+        self.scrambler_substitutions = [sequence[offset : offset + 26] for offset in range(0, len(sequence), 26)]
+
+        self.plugboard = [letter_index(plugboard.get(letter, letter)) - 1 for letter in string.ascii_uppercase]
+        # The positions of each letter in the ciphertext and at the output of the scrambler (before the plugboard)
+        self.ciphertext_positions = [[] for _ in range(26)]
+        self.scrambler_positions = [set() for _ in range(26)]
+        self.scrambler_letters = []
+        self.plaintext = []
+        for position, letter in enumerate(self.ciphertext):
+            scrambler_letter = self.scrambler_substitutions[position][self.plugboard[letter]]
+            self.ciphertext_positions[letter].append(position)
+            self.scrambler_positions[scrambler_letter].add(position)
+            self.scrambler_letters.append(scrambler_letter)
+            self.plaintext.append(self.plugboard[scrambler_letter])
+
+        self.total_score = sum(self.ngram_score(start, self.plaintext) for start in range(self.num_ngrams()))
+
+    def num_ngrams(self) -> int:
+        return max(len(self.ciphertext) - self.ngram_length + 1, 0)
+
+    def ngram_score(self, start: int, plaintext) -> float:
+        """Returns the score of the n-gram starting at the given position of the plaintext
+        (plaintext can be a dictionary giving only the changed letters, the other ones being taken from self.plaintext)
+        """
+        code = 0
+        for position in range(start, start + self.ngram_length):
+            letter = plaintext.get(position) if isinstance(plaintext, dict) else plaintext[position]
+            if letter is None:
+                letter = self.plaintext[position]
+            code = code * 26 + letter
+        return self.ngram_scores[code]
+
+    def score(self) -> float:
+        """Returns the score of the current plaintext (the same as NgramModel.score with n-grams of ngram_length)"""
+        return self.total_score / self.num_ngrams() if self.num_ngrams() else -math.inf
+
+    def plugboard_dict(self) -> dict:
+        """Returns the current plugboard connections, in the format used by Enigma"""
+        return {
+            letter_from_index(letter + 1): letter_from_index(steckered_letter + 1)
+            for letter, steckered_letter in enumerate(self.plugboard)
+            if letter < steckered_letter
+        }
+
+    def swapped_plugboard(self, first_letter: int, second_letter: int) -> list[int]:
+        """Returns the plugboard where the two letters are connected together, replacing their current connections
+        (or disconnected if they already are connected together)"""
+        plugboard = list(self.plugboard)
+        for letter in (first_letter, second_letter):
+            plugboard[plugboard[letter]] = plugboard[letter]
+            plugboard[letter] = letter
+        if self.plugboard[first_letter] != second_letter:
+            plugboard[first_letter] = second_letter
+            plugboard[second_letter] = first_letter
+        return plugboard
+
+    def changed_plaintext(self, plugboard: list[int]) -> tuple[dict, dict]:
+        """Returns the plaintext letters and scrambler output letters changed by the new plugboard given
+        (as dictionaries indexed by position)"""
+        changed_letters = [letter for letter in range(26) if plugboard[letter] != self.plugboard[letter]]
+        changed_scrambler_letters = {}
+        for letter in changed_letters:
+            for position in self.ciphertext_positions[letter]:
+                changed_scrambler_letters[position] = self.scrambler_substitutions[position][plugboard[letter]]
+
+        affected_positions = set(changed_scrambler_letters)
+        for letter in changed_letters:
+            affected_positions.update(self.scrambler_positions[letter])
+
+        changed_plaintext = {}
+        for position in affected_positions:
+            scrambler_letter = changed_scrambler_letters.get(position, self.scrambler_letters[position])
+            changed_plaintext[position] = plugboard[scrambler_letter]
+        return changed_plaintext, changed_scrambler_letters
+
+    def score_difference(self, changed_plaintext: dict) -> float:
+        """Returns the difference of total score caused by the changed plaintext letters given"""
+        affected_ngrams = set()
+        for position in changed_plaintext:
+            affected_ngrams.update(
+                range(max(position - self.ngram_length + 1, 0), min(position + 1, self.num_ngrams()))
+            )
+        difference = 0
+        for start in affected_ngrams:
+            difference += self.ngram_score(start, changed_plaintext) - self.ngram_score(start, self.plaintext)
+        return difference
+
+    def try_swap(self, first_letter: int, second_letter: int) -> bool:
+        """Connects the two letters (see swapped_plugboard) if it improves the score, and returns True if it does"""
+        plugboard = self.swapped_plugboard(first_letter, second_letter)
+        changed_plaintext, changed_scrambler_letters = self.changed_plaintext(plugboard)
+        difference = self.score_difference(changed_plaintext)
+        if difference <= 0:
+            return False
+
+        for position, scrambler_letter in changed_scrambler_letters.items():
+            self.scrambler_positions[self.scrambler_letters[position]].discard(position)
+            self.scrambler_positions[scrambler_letter].add(position)
+            self.scrambler_letters[position] = scrambler_letter
+        for position, letter in changed_plaintext.items():
+            self.plaintext[position] = letter
+        self.plugboard = plugboard
+        self.total_score += difference
+        return True
+
+    def hill_climb(self, deadline: float = None) -> bool:
+        """Tries every connection until none of them improves the score, and returns False if the deadline
+        (given as a time.time() value) was reached before"""
+        improved = True
+        while improved:
+            improved = False
+            for first_letter, second_letter in itertools.combinations(range(26), 2):
+                if deadline is not None and time.time() > deadline:
+                    return False
+                if self.try_swap(first_letter, second_letter):
+                    improved = True
+        return True
+
+
+def search_plugboard(
+    machine_class, candidate: tuple, reflector: str, ciphertext: str, num_candidates: int, deadline: float
+) -> tuple[bool, list]:
+    """Phase 3 of the ciphertext-only attack: hill-climbs the plugboard, first with the bigram and then with the
+    trigram log probabilities of the English model (the approach of Gillogly and Weierud-Sullivan)"""
+    _, rotor_order, ring_settings, starting_positions, plugboard = candidate
+    machine = machine_class(list(rotor_order), ring_settings, plugboard, reflector=reflector)
+
+    for ngram_length in (2, 3):
+        optimizer = PlugboardOptimizer(machine, ciphertext, starting_positions, ngram_length)
+        complete = optimizer.hill_climb(deadline)
+        machine.set_plugboard(optimizer.plugboard_dict())
+        if not complete:
+            break
+
+    return complete, [(optimizer.score(), rotor_order, ring_settings, starting_positions, optimizer.plugboard_dict())]
+
+
+def load_log(log_file: str, fingerprint: str) -> dict:
+    """Loads the results of the searches already done, logged as JSON lines after a header line identifying the attack
+    (an empty log if the file doesn't exist or has no complete line, in which case the header is written)
+    A line left incomplete by an interrupted run is removed from the file"""
+    log = {}
+    if log_file is None:
+        return log
+    content = b""
+    if os.path.exists(log_file):
+        with open(log_file, "rb") as file:
+            content = file.read()
+    complete_length = content.rfind(b"\n") + 1
+    lines = content[:complete_length].splitlines()
+    if not lines:
+        with open(log_file, "w") as file:
+            file.write(json.dumps({"fingerprint": fingerprint}) + "\n")
+        return log
+    if json.loads(lines[0]).get("fingerprint") != fingerprint:
+        raise ValueError("the log file was written by an attack on other inputs")
+    if complete_length < len(content):
+        os.truncate(log_file, complete_length)
+    for line in lines[1:]:
+        entry = json.loads(line)
+        candidates = [
+            (score, tuple(order), rings, positions, plug)
+            for score, order, rings, positions, plug in entry["candidates"]
+        ]
+        log[entry["phase"], json.dumps(entry["shard"])] = candidates
+    return log
+
+
+def run_phase(
+    phase: int, search_function, shards: list, machine_class, reflector: str, ciphertext: str, options: dict
+) -> list:
+    """Runs one phase of the ciphertext-only attack on a pool of processes, skipping the shards found in the log,
+    and returns all the candidates found, best first"""
+    log, log_file = options["log"], options["log_file"]
+    candidates = []
+    shards_to_search = []
+    for shard in shards:
+        logged_candidates = log.get((phase, json.dumps(shard)))
+        if logged_candidates is None:
+            shards_to_search.append(shard)
+        else:
+            candidates.extend(logged_candidates)
+
+    with ProcessPoolExecutor(max_workers=options["max_workers"]) as executor:
+        futures = {
+            executor.submit(
+                search_function,
+                machine_class,
+                shard,
+                reflector,
+                ciphertext,
+                options["num_candidates"],
+                options["deadline"],
+            ): shard
+            for shard in shards_to_search
+        }
+        for future in as_completed(futures):
+            complete, shard_candidates = future.result()
+            candidates.extend(shard_candidates)
+            # Only the shards searched entirely are logged, the other ones are searched again after a restart
+            if complete and log_file is not None:
+                with open(log_file, "a") as file:
+                    file.write(json.dumps({"phase": phase, "shard": futures[future], "candidates": shard_candidates}))
+                    file.write("\n")
+                    file.flush()
+                    os.fsync(file.fileno())
+
+    return sorted(candidates, key=lambda candidate: candidate[0], reverse=True)
+
+
+def ciphertext_only_attack(
+    ciphertext: str,
+    machine_class=EnigmaI,
+    reflector: str = "B",
+    num_candidates: int = 10,
+    time_budget: float = None,
+    max_workers: int = None,
+    log_file: str = None,
+) -> list[tuple]:
+    """Takes an Enigma ciphertext (several hundred letters are needed) and returns the most probable settings, best
+    first, as (score, rotor order, ring settings, starting positions, plugboard) tuples
+    The rotor order and starting positions are found with the index of coincidence, then the ring settings, then the
+    plugboard by hill-climbing with the bigram and trigram English model, each phase running on a pool of processes
+
+    Optional:
+    machine_class: the Enigma model (with 3 rotors) whose rotors are tried (defaults to EnigmaI)
+    reflector: the reflector used (defaults to B)
+    num_candidates: the number of candidates kept after the first phase
+    time_budget: the number of seconds after which the search stops, returning the best candidates found so far
+    max_workers: the number of processes used
+    log_file: a JSON lines file where the candidates found are logged, so that an interrupted search can be resumed
+    """
+    ciphertext = to_upper_case_without_punctuation_or_spaces(ciphertext)
+    options = {
+        "num_candidates": num_candidates,
+        "deadline": None if time_budget is None else time.time() + time_budget,
+        "max_workers": max_workers,
+        "log": load_log(
+            log_file,
+            attack_fingerprint(
+                attack="ciphertext_only",
+                ciphertext=ciphertext,
+                machine_class=machine_class.__name__,
+                reflector=reflector,
+                num_candidates=num_candidates,
+            ),
+        ),
+        "log_file": log_file,
+    }
+
+    rotor_orders = list(itertools.permutations(machine_class.ROTORS, 3))
+    candidates = run_phase(1, search_positions_by_ioc, rotor_orders, machine_class, reflector, ciphertext, options)
+    candidates = candidates[:num_candidates]
+    candidates = run_phase(2, search_ring_settings, candidates, machine_class, reflector, ciphertext, options)
+    candidates = run_phase(3, search_plugboard, candidates, machine_class, reflector, ciphertext, options)
+    return candidates
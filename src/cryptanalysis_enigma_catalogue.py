@@ -0,0 +1,173 @@
+from enigma_machine import EnigmaI, EnigmaM3, compose_permutations, substitution_sequence
+from helper_functions import *
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import bisect
+import hashlib
+import itertools
+import json
+import mmap
+import struct
+
+# A catalogue file starts with this magic, the length of its JSON header and the header itself, followed (at a
+# multiple of 8) by the sorted signature hashes (8 bytes each) and the corresponding setting codes (4 bytes each)
+CATALOGUE_MAGIC = b"ENIGMACC"
+CATALOGUE_MACHINES = {"EnigmaI": EnigmaI, "EnigmaM3": EnigmaM3}
+
+
+def cycle_lengths(permutation: bytes) -> tuple[int, ...]:
+    """Returns the lengths of the cycles of a permutation of the 0-based letter indexes, longest first"""
+    lengths = []
+    visited = [False] * len(permutation)
+    for start in range(len(permutation)):
+        length = 0
+        index = start
+        while not visited[index]:
+            visited[index] = True
+            index = permutation[index]
+            length += 1
+        if length:
+            lengths.append(length)
+    return tuple(sorted(lengths, reverse=True))
+
+
+def characteristic_cycle_structure(machine, starting_positions) -> tuple[tuple[int, ...], ...]:
+    """Returns the cycle structures of the products AD, BE and CF of the substitutions done by the machine at the six
+    first keypresses (the 'characteristic' of Rejewski, which the plugboard doesn't change)"""
+    machine.initialise_rotors(starting_positions)
+    sequence = substitution_sequence(machine, tuple(machine.rotor_positions), 6)
+    substitutions = [sequence[offset : offset + 26] for offset in range(0, 6 * 26, 26)]
+    return tuple(cycle_lengths(compose_permutations(substitutions[i], substitutions[i + 3])) for i in range(3))
+
+
+def indicators_cycle_structure(indicators: list[str]) -> tuple[tuple[int, ...], ...]:
+    """Returns the cycle structures of AD, BE and CF found from encrypted doubled message keys (6 letters each)
+    Enough indicators (usually 60 to 80) are needed for every letter to appear in each position"""
+    products = [[None] * 26 for _ in range(3)]
+    for indicator in indicators:
+        indicator = to_upper_case_without_punctuation_or_spaces(indicator)
+        if len(indicator) != 6:
+            raise ValueError(f"invalid indicator '{indicator}': indicators must have 6 letters")
+        for i in range(3):
+            products[i][letter_index(indicator[i]) - 1] = letter_index(indicator[i + 3]) - 1
+
+    for product in products:
+        if None in product:
+            raise ValueError("not enough indicators to find the whole cycle structure")
+        if sorted(product) != list(range(26)):
+            raise ValueError("inconsistent indicators: they weren't encrypted with the same settings")
+    return tuple(cycle_lengths(bytes(product)) for product in products)
+
+
+def signature_hash(cycle_structure: tuple[tuple[int, ...], ...]) -> int:
+    """Returns the 64 bits hash of a cycle structure used as key in the catalogue"""
+    data = b"\xff".join(bytes(lengths) for lengths in cycle_structure)
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def catalogue_rotor_order(machine_class, rotor_order: tuple, reflector: str) -> list[int]:
+    """Returns the signature hashes of the 17,576 starting positions of a rotor order (in the order AAA, AAB...)"""
+    machine = machine_class(list(rotor_order), "AAA", {}, reflector=reflector)
+    return [
+        signature_hash(characteristic_cycle_structure(machine, starting_positions))
+        for starting_positions in itertools.product(string.ascii_uppercase, repeat=3)
+    ]
+
+
+def build_catalogue(
+    file_path: str, machine_class=EnigmaI, rotors=("I", "II", "III"), reflector: str = "B", max_workers: int = None
+):
+    """Computes the characteristic cycle structures of every rotor order (of the given rotors) and starting position,
+    and writes them to a catalogue file indexed by cycle structure
+    The ring settings are assumed at A: like in Rejewski's catalogue, they only change when the middle rotor steps"""
+    rotor_orders = list(itertools.permutations(rotors, 3))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        hashes_by_rotor_order = executor.map(
+            catalogue_rotor_order, [machine_class] * len(rotor_orders), rotor_orders, [reflector] * len(rotor_orders)
+        )
+        entries = sorted(
+            (hash_value, rotor_order_index * 26**3 + position_index)
+            for rotor_order_index, hashes in enumerate(hashes_by_rotor_order)
+            for position_index, hash_value in enumerate(hashes)
+        )
+
+    header = json.dumps(
+        {
+            "machine": machine_class.__name__,
+            "reflector": reflector,
+            "rotor_orders": rotor_orders,
+            "num_entries": len(entries),
+        }
+    ).encode()
+    header += b" " * (-(len(CATALOGUE_MAGIC) + 4 + len(header)) % 8)
+    with open(file_path, "wb") as file:
+        file.write(CATALOGUE_MAGIC + struct.pack("<I", len(header)) + header)
+        file.write(struct.pack(f"<{len(entries)}Q", *(hash_value for hash_value, _ in entries)))
+        file.write(struct.pack(f"<{len(entries)}I", *(code for _, code in entries)))
+
+
+class CycleCatalogue:
+    """A class used to look up the settings corresponding to a cycle structure in a memory-mapped catalogue file"""
+
+    def __init__(self, file_path: str):
+        with open(file_path, "rb") as file:
+            self.memory_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.memory_map[: len(CATALOGUE_MAGIC)] != CATALOGUE_MAGIC:
+            raise ValueError("invalid catalogue file")
+        (header_length,) = struct.unpack_from("<I", self.memory_map, len(CATALOGUE_MAGIC))
+        header_start = len(CATALOGUE_MAGIC) + 4
+        header = json.loads(self.memory_map[header_start : header_start + header_length])
+
+        self.machine_class = CATALOGUE_MACHINES[header["machine"]]
+        self.reflector = header["reflector"]
+        self.rotor_orders = [tuple(rotor_order) for rotor_order in header["rotor_orders"]]
+        num_entries = header["num_entries"]
+        hashes_start = header_start + header_length
+        codes_start = hashes_start + 8 * num_entries
+        self.hashes = memoryview(self.memory_map)[hashes_start:codes_start].cast("Q")
+        self.codes = memoryview(self.memory_map)[codes_start : codes_start + 4 * num_entries].cast("I")
+        self.machines = {}
+
+    def lookup(self, cycle_structure: tuple[tuple[int, ...], ...]) -> list[tuple[tuple, str]]:
+        """Returns the (rotor order, starting positions) having the given characteristic cycle structure"""
+        hash_value = signature_hash(cycle_structure)
+        start = bisect.bisect_left(self.hashes, hash_value)
+        end = bisect.bisect_right(self.hashes, hash_value)
+
+        candidates = []
+        for code in self.codes[start:end]:
+            rotor_order = self.rotor_orders[code // 26**3]
+            starting_positions = "".join(letter_from_index((code // 26**power) % 26 + 1) for power in (2, 1, 0))
+            # The cycle structure is checked again, as different cycle structures can have the same hash
+            if rotor_order not in self.machines:
+                self.machines[rotor_order] = self.machine_class(list(rotor_order), "AAA", {}, reflector=self.reflector)
+            if characteristic_cycle_structure(self.machines[rotor_order], starting_positions) == cycle_structure:
+                candidates.append((rotor_order, starting_positions))
+        return candidates
+
+    def lookup_indicators(self, indicators: list[str]) -> list[tuple[tuple, str]]:
+        """Returns the (rotor order, starting positions) consistent with the encrypted doubled message keys given"""
+        return self.lookup(indicators_cycle_structure(indicators))
+
+    def close(self):
+        self.hashes.release()
+        self.codes.release()
+        self.memory_map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a catalogue of Enigma characteristic cycle structures")
+    parser.add_argument("file_path", help="the catalogue file to write")
+    parser.add_argument("--machine", choices=CATALOGUE_MACHINES, default="EnigmaI")
+    parser.add_argument("--rotors", nargs="+", default=["I", "II", "III"])
+    parser.add_argument("--reflector", default="B")
+    arguments = parser.parse_args()
+    build_catalogue(
+        arguments.file_path, CATALOGUE_MACHINES[arguments.machine], tuple(arguments.rotors), arguments.reflector
+    )
@@ -0,0 +1,214 @@
+from enigma_machine import EnigmaI, EnigmaM3, EnigmaM4, EnigmaSettings, compiled_machine
+from helper_functions import *
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import defaultdict
+import itertools
+import argparse
+import json
+import csv
+
+ARCHIVE_MACHINES = {"EnigmaI": EnigmaI, "EnigmaM3": EnigmaM3, "EnigmaM4": EnigmaM4}
+
+# Number of messages read from the archive before they are grouped by daily key and decrypted
+ARCHIVE_BATCH_SIZE = 10000
+
+# Maximum number of messages of the same daily key decrypted by one task (so that a busy day uses several processes)
+GROUP_CHUNK_SIZE = 500
+
+OUTPUT_FIELDS = ("id", "date", "message_key", "plaintext", "error")
+
+
+def file_format(file_path: str) -> str:
+    """Returns the format of a file from its extension ("csv", or "jsonl" otherwise)"""
+    return "csv" if file_path.lower().endswith(".csv") else "jsonl"
+
+
+def read_records(file_path: str):
+    """Yields the records of a JSON lines or CSV file (with a header row) as dicts, one at a time
+    A line which isn't a JSON object is yielded as a ValueError giving its line number, so that the next records can
+    still be read"""
+    with open(file_path, newline="") as file:
+        if file_format(file_path) == "csv":
+            yield from csv.DictReader(file)
+            return
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as error:
+                yield ValueError(f"line {line_number}: invalid JSON ({error})")
+                continue
+            if isinstance(record, dict):
+                yield record
+            else:
+                yield ValueError(f"line {line_number}: the record isn't a JSON object")
+
+
+def parse_daily_key(record: dict) -> tuple[EnigmaSettings, str | None]:
+    """Returns the settings and the ground setting (or None) of a key sheet record, whose fields are:
+    date, machine (EnigmaI by default), rotors (ex: "II I III"), ring_settings (ex: "AFK"), reflector (B by default),
+    plugboard (ex: "AR GK OX") and optionally ground_setting, the positions at which message keys are encrypted"""
+    try:
+        machine_class = ARCHIVE_MACHINES[record.get("machine") or "EnigmaI"]
+    except KeyError:
+        raise ValueError(f"invalid machine '{record['machine']}' for {record['date']}")
+    rotors = record["rotors"]
+    if isinstance(rotors, str):
+        rotors = rotors.upper().split()
+    plugboard = record.get("plugboard") or {}
+    if isinstance(plugboard, str):
+        connections = plugboard.upper().split()
+        if any(len(connection) != 2 for connection in connections):
+            raise ValueError(f"invalid plugboard '{plugboard}' for {record['date']}")
+        plugboard = {connection[0]: connection[1] for connection in connections}
+    settings = EnigmaSettings.create(
+        machine_class,
+        rotors,
+        to_upper_case_without_punctuation_or_spaces(record["ring_settings"]),
+        plugboard,
+        record.get("reflector") or "B",
+    )
+    # The machine is built here so that invalid keys are reported when the key sheet is loaded
+    compiled_machine(settings)
+    ground_setting = record.get("ground_setting") or None
+    return settings, ground_setting and to_upper_case_without_punctuation_or_spaces(ground_setting)
+
+
+def load_key_sheet(file_path: str) -> dict[str, tuple[EnigmaSettings, str | None]]:
+    """Returns the daily keys of a key sheet file (JSON lines or CSV): date -> (settings, ground setting)"""
+    key_sheet = {}
+    for record in read_records(file_path):
+        if isinstance(record, ValueError):
+            raise record
+        key_sheet[str(record["date"])] = parse_daily_key(record)
+    return key_sheet
+
+
+def message_key(settings: EnigmaSettings, ground_setting: str | None, message: dict) -> str:
+    """Returns the starting positions of a message, given either directly in its starting_positions field or by its
+    indicator: the message key encrypted at the ground setting of the day (possibly doubled, as before 1940), or
+    if there isn't any, the starting positions in clear followed by the message key encrypted at them (after 1940)"""
+    num_rotors = len(settings.rotors)
+    if message.get("starting_positions"):
+        return to_upper_case_without_punctuation_or_spaces(message["starting_positions"])
+
+    indicator = to_upper_case_without_punctuation_or_spaces(message.get("indicator") or "")
+    machine = compiled_machine(settings)
+    if ground_setting is not None:
+        if len(indicator) not in (num_rotors, 2 * num_rotors):
+            raise ValueError(f"the indicator must have {num_rotors} or {2 * num_rotors} letters")
+        key = machine.decrypt(indicator, ground_setting)
+        if len(key) == 2 * num_rotors and key[:num_rotors] != key[num_rotors:]:
+            raise ValueError(f"garbled indicator: the doubled message key decrypts to {key}")
+        return key[:num_rotors]
+
+    if len(indicator) != 2 * num_rotors:
+        raise ValueError("the message has no starting positions nor indicator")
+    return machine.decrypt(indicator[num_rotors:], indicator[:num_rotors])
+
+
+def decrypt_group(
+    settings: EnigmaSettings, ground_setting: str | None, messages: list[tuple[int, dict]]
+) -> list[tuple[int, dict]]:
+    """Decrypts (index, message) pairs sharing the same daily key with a single compiled machine, and returns the
+    (index, result) pairs"""
+    machine = compiled_machine(settings)
+    results = []
+    for index, message in messages:
+        result = {"id": message.get("id"), "date": message.get("date")}
+        try:
+            if not isinstance(message.get("text"), str):
+                raise ValueError("the message has no text")
+            result["message_key"] = message_key(settings, ground_setting, message)
+            result["plaintext"] = machine.decrypt(message["text"], result["message_key"])
+        except (ValueError, KeyError) as error:
+            result["error"] = str(error)
+        results.append((index, result))
+    return results
+
+
+def decrypt_batch(executor, key_sheet: dict, batch: list[tuple[int, dict]]) -> list[dict]:
+    """Decrypts a batch of (index, message) pairs grouped by daily key, and returns the results in the batch order"""
+    groups = defaultdict(list)
+    results = {}
+    for index, message in batch:
+        if isinstance(message, ValueError):
+            results[index] = {"id": None, "date": None, "error": str(message)}
+            continue
+        date = str(message.get("date"))
+        if date in key_sheet:
+            groups[date].append((index, message))
+        else:
+            results[index] = {"id": message.get("id"), "date": message.get("date"), "error": f"no key for {date}"}
+
+    chunks = [
+        (date, messages[start : start + GROUP_CHUNK_SIZE])
+        for date, messages in groups.items()
+        for start in range(0, len(messages), GROUP_CHUNK_SIZE)
+    ]
+    futures = {executor.submit(decrypt_group, *key_sheet[date], messages): messages for date, messages in chunks}
+    for future, messages in futures.items():
+        try:
+            results.update(future.result())
+        except BrokenProcessPool:
+            # The pool can't decrypt anything anymore, so the run stops instead of failing every next message
+            raise
+        except Exception as error:
+            # A group which couldn't be decrypted doesn't prevent the results of the other groups from being written
+            for index, message in messages:
+                results[index] = {"id": message.get("id"), "date": message.get("date"), "error": repr(error)}
+    return [results[index] for index, _ in batch]
+
+
+def decrypt_archive(
+    key_sheet_file: str,
+    archive_file: str,
+    output_file: str,
+    max_workers: int = None,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+) -> int:
+    """Decrypts an archive of messages with the daily keys of a key sheet, and writes the results as they are found
+    (in the order of the archive); returns the number of messages read
+
+    Parameters:
+    key_sheet_file: the daily keys (see parse_daily_key), as JSON lines or CSV
+    archive_file: the messages, as JSON lines or CSV, with the fields id, date, text and indicator (see message_key)
+    output_file: the results, as JSON lines or CSV, with the fields id, date, message_key, plaintext and error
+
+    Optional:
+    max_workers: the number of processes used
+    batch_size: the number of messages read at once (each batch is grouped by daily key, and the compiled machines are
+    kept by compiled_machine in every process, so a daily key is compiled once per process)
+    """
+    key_sheet = load_key_sheet(key_sheet_file)
+    messages = enumerate(read_records(archive_file))
+    num_messages = 0
+    with open(output_file, "w", newline="") as file, ProcessPoolExecutor(max_workers=max_workers) as executor:
+        if file_format(output_file) == "csv":
+            writer = csv.DictWriter(file, OUTPUT_FIELDS)
+            writer.writeheader()
+            write_result = writer.writerow
+        else:
+            write_result = lambda result: file.write(json.dumps(result) + "\n")
+
+        while batch := list(itertools.islice(messages, batch_size)):
+            for result in decrypt_batch(executor, key_sheet, batch):
+                write_result(result)
+            num_messages += len(batch)
+    return num_messages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decrypt an archive of Enigma messages with a daily key sheet")
+    parser.add_argument("key_sheet", help="the key sheet (.jsonl or .csv)")
+    parser.add_argument("archive", help="the messages (.jsonl or .csv)")
+    parser.add_argument("output", help="the file where the results are written (.jsonl or .csv)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    arguments = parser.parse_args()
+    num_messages = decrypt_archive(
+        arguments.key_sheet, arguments.archive, arguments.output, arguments.workers, arguments.batch_size
+    )
+    print(f"{num_messages} messages decrypted")
@@ -0,0 +1,88 @@
+from enigma_machine import EnigmaI, LETTERS_TO_INDEXES, wiring_to_indexes, invert_permutation
+from helper_functions import to_upper_case_without_punctuation_or_spaces
+import numpy as np
+
+
+def machine_tables(machine_class=EnigmaI) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the wirings, inverse wirings and turnover tables of the rotors of an Enigma model, as arrays
+    of shape (number of rotors, 26) in the order of machine_class.ROTORS"""
+    wirings = np.array([list(wiring_to_indexes(wiring)) for wiring in machine_class.ROTORS.values()], dtype=np.intp)
+    inverse_wirings = np.array(
+        [list(invert_permutation(wiring_to_indexes(wiring))) for wiring in machine_class.ROTORS.values()],
+        dtype=np.intp,
+    )
+    turnovers = np.zeros((len(machine_class.ROTORS), 26), dtype=np.intp)
+    for rotor_index, rotor in enumerate(machine_class.ROTORS):
+        for notch in machine_class.NOTCHES[rotor]:
+            turnovers[rotor_index, ord(notch) - ord("A")] = 1
+    return wirings, inverse_wirings, turnovers
+
+
+def encrypt_batch(
+    text: str,
+    rotor_orders,
+    ring_settings,
+    starting_positions,
+    plugboards=None,
+    reflector: str = "B",
+    machine_class=EnigmaI,
+) -> np.ndarray:
+    """Encrypts (or decrypts) the same text under many settings at once, and returns an array of shape
+    (number of settings, number of letters) containing the letter indexes (A=0) of each result
+
+    Parameters (arrays with one row per setting, rotors given from left to right):
+    rotor_orders: rotor indexes of shape (n, 3), in the order of machine_class.ROTORS (ex: [0, 1, 2] for I, II, III)
+    ring_settings: ring settings of shape (n, 3) as letter indexes with A=0
+    starting_positions: starting positions of shape (n, 3) as letter indexes with A=0
+
+    Optional:
+    plugboards: plugboard substitutions of shape (n, 26) (the identity is used if not precised)
+    reflector: the name of the reflector used by all settings (defaults to B)
+    machine_class: the Enigma model with 3 rotors whose wirings are used (defaults to EnigmaI)
+    """
+    wirings, inverse_wirings, turnovers = machine_tables(machine_class)
+    reflector_table = np.array(list(wiring_to_indexes(machine_class.REFLECTORS[reflector])), dtype=np.intp)
+
+    rotor_orders = np.asarray(rotor_orders, dtype=np.intp)
+    ring_settings = np.asarray(ring_settings, dtype=np.intp)
+    positions = np.asarray(starting_positions, dtype=np.intp)
+    num_settings = len(rotor_orders) if rotor_orders.ndim else 0
+    if any(array.shape != (num_settings, 3) for array in (rotor_orders, ring_settings, positions)):
+        raise ValueError("rotor_orders, ring_settings and starting_positions must have shape (n, 3)")
+
+    if plugboards is None:
+        plugboards = np.broadcast_to(np.arange(26, dtype=np.intp), (num_settings, 26))
+    else:
+        plugboards = np.asarray(plugboards, dtype=np.intp)
+        if plugboards.shape != (num_settings, 26):
+            raise ValueError("plugboards must have shape (n, 26)")
+
+    # We convert left-to-right indexing to right-to-left, as in Enigma
+    rotor_orders = rotor_orders[:, ::-1]
+    ring_settings = ring_settings[:, ::-1]
+    positions = positions[:, ::-1].copy()
+    settings_indexes = np.arange(num_settings)
+
+    text = to_upper_case_without_punctuation_or_spaces(text)
+    letters = np.frombuffer(text.encode().translate(LETTERS_TO_INDEXES), dtype=np.uint8)
+    result = np.empty((num_settings, len(letters)), dtype=np.uint8)
+
+    for letter_position, letter in enumerate(letters):
+        # We step the rotors of every setting (with the same double-stepping as Enigma.step_rotors)
+        middle_turnover = turnovers[rotor_orders[:, 1], positions[:, 1]]
+        right_turnover = turnovers[rotor_orders[:, 0], positions[:, 0]]
+        positions[:, 2] += middle_turnover
+        positions[:, 1] += middle_turnover + right_turnover
+        positions[:, 0] += 1
+        positions %= 26
+        offsets = (positions - ring_settings) % 26
+
+        indexes = plugboards[:, letter]
+        for i in range(3):
+            indexes = (wirings[rotor_orders[:, i], (indexes + offsets[:, i]) % 26] - offsets[:, i]) % 26
+        indexes = reflector_table[indexes]
+        for i in range(2, -1, -1):
+            indexes = (inverse_wirings[rotor_orders[:, i], (indexes + offsets[:, i]) % 26] - offsets[:, i]) % 26
+        result[:, letter_position] = plugboards[settings_indexes, indexes]
+
+    return result
@@ -1,7 +1,7 @@
 from InquirerPy import inquirer
 from InquirerPy.base.control import Choice
 from InquirerPy.utils import color_print
-from enigma_machine import EnigmaI, EnigmaM3, EnigmaM4
+from enigma_machine import EnigmaI, EnigmaM3, EnigmaM4, EnigmaSettings, compiled_machine
 from helper_functions import print_result
 import random
 import string
@@ -139,14 +139,18 @@ class EnigmaInterface:
             message="Enter message to encrypt or decrypt:", multiline=True
         ).execute()
 
-        enigma_machine_to_use = self.enigma_model(
-            rotors=self.rotors,
-            ring_settings=self.ring_settings,
-            reflector=self.reflector,
-            plugboard=self.plugboard,
-            starting_positions=self.starting_positions,
+        enigma_machine_to_use = compiled_machine(
+            EnigmaSettings.create(
+                self.enigma_model,
+                rotors=self.rotors,
+                ring_settings=self.ring_settings,
+                reflector=self.reflector,
+                plugboard=self.plugboard,
+            )
+        )
+        encrypted_or_decrypted_message = enigma_machine_to_use.encrypt(
+            message_to_encrypt_or_decrypt, self.starting_positions
         )
-        encrypted_or_decrypted_message = enigma_machine_to_use.encrypt(message_to_encrypt_or_decrypt)
         print_result(encrypted_or_decrypted_message)
 
     def ask_next_action(self) -> str:
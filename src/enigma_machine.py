@@ -1,5 +1,94 @@
 from helper_functions import *
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import NamedTuple
 import string
+import codecs
+import copy
+import sys
+import io
+
+# Appended to a 26-letter substitution to use it as a bytes.translate table
+TRANSLATION_TABLE_PADDING = bytes(range(26, 256))
+
+# Number of stepping state tables kept by state_substitutions (26^3 substitutions, 457 KB each)
+STATE_TABLE_CACHE_SIZE = 32
+
+# Texts are split in chunks of this many letters when encrypted by several processes
+PARALLEL_CHUNK_LENGTH = 1 << 16
+
+# Size of the buffer used when encrypting streams
+STREAM_BUFFER_SIZE = 1 << 16
+
+# Number of compiled machines kept by compiled_machine
+MACHINE_CACHE_SIZE = 256
+
+
+def wiring_to_indexes(wiring: str) -> bytes:
+    """Converts a wiring given as a string of 26 letters to the corresponding 0-based letter indexes"""
+    return wiring.upper().encode().translate(LETTERS_TO_INDEXES)
+
+
+def invert_permutation(permutation: bytes) -> bytes:
+    """Returns the inverse of a permutation of the 0-based letter indexes"""
+    inverse = bytearray(len(permutation))
+    for index, value in enumerate(permutation):
+        inverse[value] = index
+    return bytes(inverse)
+
+
+def compose_permutations(*permutations: bytes) -> bytes:
+    """Returns the permutation obtained by applying the given permutations one after the other"""
+    result = bytes(range(26))
+    for permutation in permutations:
+        result = result.translate(permutation + TRANSLATION_TABLE_PADDING)
+    return result
+
+
+def rotor_tables(wiring: bytes, ring_position: int) -> tuple[list[bytes], list[bytes]]:
+    """Returns the forward and backward substitutions of a rotor for each of its 26 positions
+    (both the position and the ring position are 0-based here)"""
+    inverse_wiring = invert_permutation(wiring)
+    forward_tables = []
+    backward_tables = []
+    for position in range(26):
+        offset = (position - ring_position) % 26
+        forward_tables.append(bytes((wiring[(index + offset) % 26] - offset) % 26 for index in range(26)))
+        backward_tables.append(bytes((inverse_wiring[(index + offset) % 26] - offset) % 26 for index in range(26)))
+    return forward_tables, backward_tables
+
+
+def reciprocal_plugboard(plugboard: dict) -> dict:
+    """Returns the plugboard given with each connection in both directions (ex: {"A": "B"} gives {"A": "B", "B": "A"})"""
+    new_plugboard = {}
+    for key, value in plugboard.items():
+        if new_plugboard.get(key) == value and new_plugboard.get(value) == key:
+            continue
+        if key in new_plugboard.keys() or value in new_plugboard.keys():
+            raise ValueError("invalid plugboard: incompatible connections found")
+        new_plugboard[key] = value
+        new_plugboard[value] = key
+    return new_plugboard
+
+
+def count_turnovers(turnover_table: tuple, position: int, num_keypresses: int) -> int:
+    """Returns how many times a rotor starting at the given 0-based position is at a notch position
+    during the next num_keypresses keypresses (it steps at each keypress)"""
+    num_revolutions, remaining_keypresses = divmod(num_keypresses, 26)
+    count = num_revolutions * sum(turnover_table)
+    for offset in range(remaining_keypresses):
+        count += turnover_table[(position + offset) % 26]
+    return count
+
+
+def has_adjacent_notches(turnover_table: tuple) -> bool:
+    """Returns True if a rotor has two notches next to each other"""
+    return any(turnover_table[position] and turnover_table[(position + 1) % 26] for position in range(26))
+
+
+def encrypt_chunk(machine: "Enigma", chunk: str, starting_positions: list[int]) -> str:
+    """Encrypts a chunk of text from the given starting positions (used by Enigma.encrypt_parallel)"""
+    return machine.encrypt(chunk, starting_positions)
 
 
 class Enigma:
@@ -52,11 +141,10 @@ class Enigma:
 
         # We convert left-to-right indexing to right-to-left as it is more practical
         self.rotor_wirings = list(reversed(rotors))
-        self.rotors = list(reversed(rotors))
         self.rotor_notches = list(reversed(rotor_notches))
         self.ring_positions = list(reversed(ring_settings))
-        self.rotor_positions = list(reversed(starting_positions))
-        self.starting_positions = list(reversed(starting_positions))
+        self.rotor_positions = None
+        self.starting_positions = None
 
         self.plugboard = plugboard
         self.reflector = reflector
@@ -68,11 +156,9 @@ class Enigma:
             if isinstance(ring_position, str):
                 self.ring_positions[index] = letter_index(ring_position)
 
-        if self.rotor_positions is not None:
-            for index, rotor_position in enumerate(self.rotor_positions):
-                if isinstance(rotor_position, str):
-                    self.rotor_positions[index] = letter_index(rotor_position)
-            self.starting_positions = self.rotor_positions
+        if starting_positions is not None:
+            self.starting_positions = self.convert_positions(starting_positions)
+            self.rotor_positions = list(self.starting_positions)
 
         for index, rotor_notch in enumerate(self.rotor_notches):
             new_rotor_notch = []
@@ -83,16 +169,64 @@ class Enigma:
                     new_rotor_notch.append(notch)
             self.rotor_notches[index] = new_rotor_notch
 
-        # Reversing the plugboard connections
-        new_plugboard = {}
-        for key, value in self.plugboard.items():
-            if new_plugboard.get(key) == value and new_plugboard.get(value) == key:
-                continue
-            if key in new_plugboard.keys() or value in new_plugboard.keys():
-                raise ValueError("invalid plugboard: incompatible connections found")
-            new_plugboard[key] = value
-            new_plugboard[value] = key
-        self.plugboard = new_plugboard
+        self.plugboard = reciprocal_plugboard(self.plugboard)
+
+        self.compile()
+
+    def convert_positions(self, positions: list[int | str] | str) -> list[int]:
+        """Converts rotor positions given from left to right (as letters or letter indexes with A=1)
+        to the right-to-left list of letter indexes used internally"""
+        if len(positions) != len(self.rotor_wirings):
+            raise ValueError("invalid length for starting_positions")
+        converted_positions = []
+        for position in reversed(positions):
+            if isinstance(position, str):
+                position = letter_index(position)
+            converted_positions.append(position)
+        return converted_positions
+
+    def compile(self):
+        """Converts the rotors, reflector and plugboard to integer substitution tables, so that
+        encrypting only does table lookups and offset arithmetic"""
+        self.reflector_table = wiring_to_indexes(self.reflector)
+
+        # forward_tables[i][position] is the substitution done by the rotor i at the given 0-based position
+        self.forward_tables = []
+        self.backward_tables = []
+        for rotor_wiring, ring_position in zip(self.rotor_wirings, self.ring_positions):
+            forward_tables, backward_tables = rotor_tables(wiring_to_indexes(rotor_wiring), ring_position - 1)
+            self.forward_tables.append(forward_tables)
+            self.backward_tables.append(backward_tables)
+
+        # turnover_tables[i][position] is True when the rotor i makes the next rotor step at the given 0-based position
+        self.turnover_tables = [
+            tuple(position + 1 in rotor_notch for position in range(26)) for rotor_notch in self.rotor_notches
+        ]
+
+        self.compile_plugboard()
+
+    def compile_plugboard(self):
+        """Converts the plugboard to an integer substitution table, merged into the rightmost rotor tables"""
+        self.plugboard_table = bytes(
+            letter_index(self.plugboard.get(letter, letter)) - 1 for letter in string.ascii_uppercase
+        )
+        # The plugboard is merged into the rightmost rotor tables, as it is always crossed just before/after them
+        self.entry_tables = [compose_permutations(self.plugboard_table, table) for table in self.forward_tables[0]]
+        self.exit_tables = [compose_permutations(table, self.plugboard_table) for table in self.backward_tables[0]]
+
+    def set_plugboard(self, plugboard: dict):
+        """Changes the plugboard connections (only the tables depending on the plugboard are compiled again)"""
+        self.plugboard = reciprocal_plugboard(plugboard)
+        self.compile_plugboard()
+
+    def static_reflector_table(self, rotor_positions: list[int]) -> bytes:
+        """Returns the substitution done by the reflector together with the rotors that never step
+        (the 4th rotor of the M4), for the given rotor positions"""
+        table = self.reflector_table
+        for i in range(3, len(self.rotor_wirings)):
+            position = rotor_positions[i] - 1
+            table = compose_permutations(self.forward_tables[i][position], table, self.backward_tables[i][position])
+        return table
 
     def has_to_step(self, rotor_index: int) -> bool:
         """Returns True if the given rotor has to step and False otherwise"""
@@ -107,10 +241,11 @@ class Enigma:
             else:  # there are several notches for this rotor
                 return self.rotor_positions[rotor_index - 1] in rotor_notch
 
+        return False  # the 4th rotor of the M4 never steps
+
     def step_rotor(self, rotor_index: int, num_steps: int = 1):
         """Steps the rotor given"""
         self.rotor_positions[rotor_index] = to_number_between_1_and_26(self.rotor_positions[rotor_index] + num_steps)
-        self.rotors[rotor_index] = rotate_rotor(self.rotors[rotor_index], offset=num_steps)
 
     def step_rotors(self):
         """Steps the rotors of the Enigma machine"""
@@ -130,74 +265,137 @@ class Enigma:
 
         # If there is one the 4th rotor doesn't turn
 
-    def initialise_rotors(self):
-        for i in range(len(self.rotors)):
-            rotor_wiring = self.rotor_wirings[i]
-            ring_position = self.ring_positions[i]
-            starting_position = self.starting_positions[i]
-
-            self.rotors[i] = rotate_rotor(self.rotor_wirings[i], offset=starting_position - ring_position)
-
-    def encrypt(self, text: str, starting_positions=None) -> str:
-        """Returns the encrypted text from the one given
-        If starting_positions is not precised, the ones given in the beginning will be used"""
+    def initialise_rotors(self, starting_positions=None):
+        """Puts the rotors back to the starting positions (the ones given in the beginning if not precised)"""
         if starting_positions is not None:
-            if len(starting_positions) != len(self.rotors):
-                raise ValueError("invalid length for starting_positions")
-            self.rotor_positions = starting_positions
+            self.rotor_positions = self.convert_positions(starting_positions)
+        elif self.starting_positions is not None:
+            self.rotor_positions = list(self.starting_positions)
         else:
-            self.rotor_positions = self.starting_positions
-
-        if self.rotor_positions is None:
             raise ValueError("starting_positions must be precised")
 
-        self.initialise_rotors()
-
-        list_of_encrypted_letters = []
-
-        if self.preserve_non_alphabetic_characters:
-            text = text.upper()
-        else:
-            text = to_upper_case_without_punctuation_or_spaces(text)
-
-        for letter in to_upper_case_without_punctuation_or_spaces(text):
-            if letter not in string.ascii_uppercase:  # the "letter" to encrypt isn't a letter
-                list_of_encrypted_letters.append(letter)
-                continue
-
-            # We step the rotors once
+    def encrypt_indexes(self, indexes: bytes) -> bytes:
+        """Encrypts a sequence of 0-based letter indexes from the current rotor positions, and steps the rotors
+        accordingly (this is the compiled engine used by encrypt)"""
+        state = EnigmaState(self, self.rotor_positions)
+        encrypted_indexes = run_engine(self, indexes, state)
+        self.rotor_positions[:3] = state.rotor_positions()
+        return encrypted_indexes
+
+    def seek(self, num_keypresses: int, starting_positions=None) -> list[int]:
+        """Puts the rotors in the positions they have after num_keypresses keypresses from the starting positions,
+        without simulating each keypress, and returns these positions (from left to right, with A=1)
+        If starting_positions is not precised, the ones given in the beginning will be used"""
+        self.initialise_rotors(starting_positions)
+        right_turnover, middle_turnover, _ = self.turnover_tables[:3]
+
+        if has_adjacent_notches(right_turnover) or has_adjacent_notches(middle_turnover):
+            # The jump ahead below relies on double steps never happening twice in a row
+            for _ in range(num_keypresses):
+                self.step_rotors()
+            return list(reversed(self.rotor_positions))
+
+        # The first keypresses are simulated until the middle rotor has left its notch position, so that
+        # afterwards a double step always happens just after the middle rotor reaches a notch position
+        while num_keypresses > 0 and middle_turnover[self.rotor_positions[1] - 1]:
             self.step_rotors()
+            num_keypresses -= 1
+
+        right_position, middle_position, left_position = (position - 1 for position in self.rotor_positions[:3])
+
+        # The middle rotor is moved by the right rotor each time the right rotor is at a notch position
+        num_middle_steps = count_turnovers(right_turnover, right_position, num_keypresses)
+        # If the last of these steps is done at the very last keypress, the double step which follows doesn't happen
+        last_step_is_final = num_keypresses > 0 and right_turnover[(right_position + num_keypresses - 1) % 26]
+        if last_step_is_final:
+            num_middle_steps -= 1
+
+        # Each notch position of the middle rotor is skipped by a double step, which also moves the left rotor,
+        # so a revolution of the middle rotor takes 26 - (number of notches) steps
+        num_notches = sum(middle_turnover)
+        num_revolutions, num_middle_steps = divmod(num_middle_steps, 26 - num_notches)
+        left_position += num_revolutions * num_notches
+        for _ in range(num_middle_steps):
+            middle_position = (middle_position + 1) % 26
+            if middle_turnover[middle_position]:
+                middle_position = (middle_position + 1) % 26
+                left_position += 1
+        if last_step_is_final:
+            middle_position = (middle_position + 1) % 26
+
+        self.rotor_positions[:3] = [
+            (right_position + num_keypresses) % 26 + 1,
+            middle_position + 1,
+            left_position % 26 + 1,
+        ]
+        return list(reversed(self.rotor_positions))
+
+    def encrypt_parallel(
+        self,
+        text: str,
+        starting_positions=None,
+        max_workers: int = None,
+        chunk_length: int = PARALLEL_CHUNK_LENGTH,
+    ) -> str:
+        """Returns the encrypted text from the one given, splitting it in chunks encrypted by a pool of processes
+        (each chunk starts from the rotor positions found with seek)
+        If starting_positions is not precised, the ones given in the beginning will be used"""
+        text = to_upper_case_without_punctuation_or_spaces(text)
+        chunks = []
+        chunks_starting_positions = []
+        for chunk_start in range(0, len(text), chunk_length):
+            chunks.append(text[chunk_start : chunk_start + chunk_length])
+            chunks_starting_positions.append(self.seek(chunk_start, starting_positions))
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            encrypted_chunks = executor.map(encrypt_chunk, [self] * len(chunks), chunks, chunks_starting_positions)
+            return "".join(encrypted_chunks)
+
+    def encryptor(self, starting_positions=None) -> "EnigmaEncryptor":
+        """Returns an incremental encryptor keeping the rotor positions between the chunks it encrypts
+        If starting_positions is not precised, the ones given in the beginning will be used"""
+        return EnigmaEncryptor(self, starting_positions)
+
+    def settings_key(self) -> tuple:
+        """Returns a hashable tuple describing the wiring of the machine (everything but the rotor positions),
+        in the same format as the constructor arguments"""
+        return (
+            tuple(reversed(self.rotor_wirings)),
+            tuple(tuple(rotor_notch) for rotor_notch in reversed(self.rotor_notches)),
+            tuple(reversed(self.ring_positions)),
+            self.reflector,
+            tuple(sorted(self.plugboard.items())),
+        )
 
-            # The letter passes through the plugboard
-            letter = self.plugboard.get(letter, letter)
-
-            # It then passes through the rotors
-            for i in range(len(self.rotors)):
-                current_rotor = self.rotors[i]
-                letter = current_rotor[letter_index(letter) - 1]
-                current_rotor_position = self.rotor_positions[i]
-                current_ring_position = self.ring_positions[i]
-                current_rotor_offset = to_number_between_1_and_26(current_rotor_position - current_ring_position)
-                letter = shift_letter(letter, -current_rotor_offset)
-
-            # It passes through the reflector
-            letter = self.reflector[letter_index(letter) - 1]
-
-            # It passes back again through the rotors
-            for i in range(len(self.rotors) - 1, -1, -1):
-                current_rotor = self.rotors[i]
-                current_rotor_position = self.rotor_positions[i]
-                current_ring_position = self.ring_positions[i]
-                current_rotor_offset = to_number_between_1_and_26(current_rotor_position - current_ring_position)
-                letter = shift_letter(letter, current_rotor_offset)
-                letter = letter_from_index(current_rotor.index(letter) + 1)
+    def keystream(self, length: int, starting_positions=None) -> bytes:
+        """Returns the substitutions done by the machine for each of the length next keypresses from the
+        starting positions, concatenated: the letter index x is encrypted to keystream[26 * i + x] at position i
+        The substitutions of every stepping state are memoized once for each settings (see state_substitutions), so
+        messages encrypted with the same settings share them whatever their starting positions"""
+        self.initialise_rotors(starting_positions)
+        table = state_substitutions(self.settings_key(), tuple(self.rotor_positions[3:]))
+        return b"".join(
+            table[26 * state : 26 * state + 26] for state in stepping_states(self, self.rotor_positions, length)
+        )
 
-            # It returns through the plugboard
-            letter = self.plugboard.get(letter, letter)
+    def encrypt_with_keystream(self, text: str, starting_positions=None) -> str:
+        """Returns the encrypted text from the one given, using the memoized keystream (one table lookup per letter)
+        If starting_positions is not precised, the ones given in the beginning will be used"""
+        indexes = letter_indexes(text)
+        self.initialise_rotors(starting_positions)
+        table = state_substitutions(self.settings_key(), tuple(self.rotor_positions[3:]))
+        states = stepping_states(self, self.rotor_positions, len(indexes))
+        encrypted_indexes = bytes(table[26 * state + index] for state, index in zip(states, indexes))
+        return encrypted_indexes.translate(INDEXES_TO_LETTERS).decode()
 
-            list_of_encrypted_letters.append(letter)
+    def encrypt(self, text: str, starting_positions=None) -> str:
+        """Returns the encrypted text from the one given
+        If starting_positions is not precised, the ones given in the beginning will be used"""
+        self.initialise_rotors(starting_positions)
 
-        return "".join(list_of_encrypted_letters)
+        # Non-alphabetic characters are never encrypted by the machine, so they are removed
+        encrypted_indexes = self.encrypt_indexes(letter_indexes(text))
+        return encrypted_indexes.translate(INDEXES_TO_LETTERS).decode()
 
     def decrypt(self, text: str, starting_positions=None):
         """Returns the decrypted text from the one given
@@ -205,6 +403,232 @@ class Enigma:
         return self.encrypt(text, starting_positions)
 
 
+class EnigmaState:
+    """The rotor positions during one encryption (0-based, the 4th rotor of the M4 being merged with the reflector),
+    kept apart from the machine so that a machine can be used by several threads at the same time"""
+
+    __slots__ = ("right_position", "middle_position", "left_position", "reflector_table")
+
+    def __init__(self, machine: Enigma, rotor_positions: list[int]):
+        """Parameters:
+        machine: the Enigma machine used
+        rotor_positions: the rotor positions from right to left, as letter indexes with A=1
+        """
+        self.right_position, self.middle_position, self.left_position = (
+            position - 1 for position in rotor_positions[:3]
+        )
+        self.reflector_table = machine.static_reflector_table(rotor_positions)
+
+    def rotor_positions(self) -> list[int]:
+        """Returns the positions of the three stepping rotors from right to left, as letter indexes with A=1"""
+        return [self.right_position + 1, self.middle_position + 1, self.left_position + 1]
+
+
+@lru_cache(maxsize=None)
+def turnover_distances(turnover_table: tuple) -> tuple:
+    """Returns, for each 0-based position of a rotor, the number of steps before it is at a notch position
+    (None if the rotor has no notch)"""
+    distances = []
+    for position in range(26):
+        notch_distances = [distance for distance in range(26) if turnover_table[(position + distance) % 26]]
+        distances.append(notch_distances[0] if notch_distances else None)
+    return tuple(distances)
+
+
+def stepping_segments(turnover_tables: list, rotor_positions: tuple, length: int):
+    """Yields the (start, end, middle position, left position) segments of the length next keypresses during which
+    the middle and left rotors don't move, from the given 0-based (right, middle, left) rotor positions and with the
+    given turnover tables of the right and middle rotors (same stepping as Enigma.step_rotors)
+    The right rotor is at the position (right position + i + 1) % 26 when the keypress i is encrypted"""
+    right_position, middle_position, left_position = rotor_positions
+    right_turnover, middle_turnover = turnover_tables[:2]
+    distances = turnover_distances(right_turnover)
+    start = 0
+    while start < length:
+        # Stepping of the middle and left rotors at the keypress start
+        if middle_turnover[middle_position]:
+            left_position = (left_position + 1) % 26
+            middle_position = (middle_position + 1) % 26
+        if right_turnover[(right_position + start) % 26]:
+            middle_position = (middle_position + 1) % 26
+
+        # They step again at the next keypress if the middle rotor double steps, otherwise when the right rotor
+        # reaches its next notch position
+        if middle_turnover[middle_position]:
+            end = start + 1
+        else:
+            distance = distances[(right_position + start + 1) % 26]
+            end = start + 1 + (distance if distance is not None else length)
+        yield start, min(end, length), middle_position, left_position
+        start = end
+
+
+def inner_substitution(machine: Enigma, middle_position: int, left_position: int, reflector_table: bytes) -> bytes:
+    """Returns the substitution done by the middle and left rotors at the given 0-based positions, the reflector
+    (reflector_table, see Enigma.static_reflector_table) and back, as a table for bytes.translate"""
+    return (
+        compose_permutations(
+            machine.forward_tables[1][middle_position],
+            machine.forward_tables[2][left_position],
+            reflector_table,
+            machine.backward_tables[2][left_position],
+            machine.backward_tables[1][middle_position],
+        )
+        + TRANSLATION_TABLE_PADDING
+    )
+
+
+def run_engine(machine: Enigma, indexes: bytes, state: EnigmaState) -> bytes:
+    """Encrypts a sequence of 0-based letter indexes with the compiled tables of the machine, starting from the rotor
+    positions of state and stepping them (the machine itself is only read)"""
+    entry_tables, exit_tables = machine.entry_tables, machine.exit_tables
+    right_position = state.right_position
+    segments = stepping_segments(
+        machine.turnover_tables, (right_position, state.middle_position, state.left_position), len(indexes)
+    )
+
+    encrypted_indexes = bytearray(len(indexes))
+    for start, end, middle_position, left_position in segments:
+        # Between two steps of the middle rotor, the letter only passes through the plugboard and the right rotor on
+        # each side of the same substitution
+        inner_table = inner_substitution(machine, middle_position, left_position, state.reflector_table)
+        for i in range(start, end):
+            position = (right_position + i + 1) % 26
+            encrypted_indexes[i] = exit_tables[position][inner_table[entry_tables[position][indexes[i]]]]
+        state.middle_position, state.left_position = middle_position, left_position
+
+    state.right_position = (right_position + len(indexes)) % 26
+    return bytes(encrypted_indexes)
+
+
+def reentrant_encrypt(machine: Enigma, text: str, starting_positions=None) -> str:
+    """Returns the text encrypted by the machine, like Enigma.encrypt but without modifying the machine, so that
+    one machine (for instance from compiled_machine) can be used by several threads at the same time without locking
+    If starting_positions is not precised, the ones given when creating the machine will be used"""
+    if starting_positions is not None:
+        rotor_positions = machine.convert_positions(starting_positions)
+    elif machine.starting_positions is not None:
+        rotor_positions = machine.starting_positions
+    else:
+        raise ValueError("starting_positions must be precised")
+
+    indexes = letter_indexes(text)
+    encrypted_indexes = run_engine(machine, indexes, EnigmaState(machine, rotor_positions))
+    return encrypted_indexes.translate(INDEXES_TO_LETTERS).decode()
+
+
+class EnigmaEncryptor:
+    """A class used to encrypt a long text chunk by chunk, the rotors keeping their positions between chunks"""
+
+    def __init__(self, machine: Enigma, starting_positions=None):
+        """Parameters:
+        machine: the Enigma machine whose settings are used (it isn't modified)
+
+        Optional:
+        starting_positions: the rotor starting positions (defaults to the ones of the machine)
+        """
+        # The copy shares the compiled tables of the machine but has its own rotor positions
+        self.machine = copy.copy(machine)
+        self.machine.initialise_rotors(starting_positions)
+        # A character may be split between two bytes chunks, so they are decoded incrementally
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def update(self, chunk: str | bytes) -> str | bytes:
+        """Encrypts the next chunk of text, and returns the encrypted chunk (with the same type as the one given)
+        Bytes chunks are decoded as UTF-8, so that they are normalized like the same text given as str chunks"""
+        if isinstance(chunk, str):
+            indexes = letter_indexes(chunk)
+            return self.machine.encrypt_indexes(indexes).translate(INDEXES_TO_LETTERS).decode()
+
+        chunk = bytes(chunk)
+        if chunk.isascii() and not self.decoder.getstate()[0]:
+            indexes = chunk.upper().translate(LETTERS_TO_INDEXES, NON_LETTER_BYTES)
+        else:
+            indexes = letter_indexes(self.decoder.decode(chunk))
+        return self.machine.encrypt_indexes(indexes).translate(INDEXES_TO_LETTERS)
+
+    def encrypt_stream(self, input_stream=None, output_stream=None, buffer_size: int = STREAM_BUFFER_SIZE):
+        """Encrypts everything read from input_stream (defaults to the standard input) and writes it to
+        output_stream (defaults to the standard output), reading at most buffer_size characters at a time
+        Both streams can be either text or binary files"""
+        if input_stream is None:
+            input_stream = sys.stdin.buffer
+        if output_stream is None:
+            output_stream = sys.stdout.buffer
+
+        while chunk := input_stream.read(buffer_size):
+            encrypted_chunk = self.update(chunk)
+            # The encrypted letters are ASCII, so they can be written to a stream of the other type
+            if isinstance(output_stream, io.TextIOBase):
+                if isinstance(encrypted_chunk, bytes):
+                    encrypted_chunk = encrypted_chunk.decode()
+            elif isinstance(encrypted_chunk, str):
+                encrypted_chunk = encrypted_chunk.encode()
+            output_stream.write(encrypted_chunk)
+        output_stream.flush()
+
+
+@lru_cache(maxsize=STATE_TABLE_CACHE_SIZE)
+def state_substitutions(settings_key: tuple, static_positions: tuple) -> bytes:
+    """Returns the 26-letter substitutions done by the machine described by settings_key in each of its 26^3 stepping
+    states, concatenated: the substitution done with the 0-based positions (right, middle, left) starts at
+    26 * (676 * left + 26 * middle + right); static_positions are the positions of the rotors which never step
+    (the 4th rotor of the M4)"""
+    rotors, rotor_notches, ring_settings, reflector, plugboard = settings_key
+    machine = Enigma(
+        rotors=list(rotors),
+        rotor_notches=list(rotor_notches),
+        ring_settings=list(ring_settings),
+        reflector=reflector,
+        plugboard=dict(plugboard),
+    )
+    static_reflector_table = machine.static_reflector_table([1, 1, 1, *static_positions])
+
+    substitutions = []
+    for left_position in range(26):
+        for middle_position in range(26):
+            # The middle and left rotors are the same for the 26 positions of the right rotor
+            inner_table = inner_substitution(machine, middle_position, left_position, static_reflector_table)
+            for right_position in range(26):
+                exit_table = machine.exit_tables[right_position] + TRANSLATION_TABLE_PADDING
+                substitutions.append(machine.entry_tables[right_position].translate(inner_table).translate(exit_table))
+    return b"".join(substitutions)
+
+
+def stepping_states(machine: Enigma, rotor_positions: list[int], length: int):
+    """Yields the stepping states (676 * left + 26 * middle + right, with 0-based positions) of the machine at each
+    of the length next keypresses from the given (right-to-left) rotor positions"""
+    right_position = rotor_positions[0] - 1
+    segments = stepping_segments(
+        machine.turnover_tables, tuple(position - 1 for position in rotor_positions[:3]), length
+    )
+    for start, end, middle_position, left_position in segments:
+        state = 676 * left_position + 26 * middle_position
+        for i in range(start, end):
+            yield state + (right_position + i + 1) % 26
+
+
+def substitution_sequence(machine: Enigma, rotor_positions: tuple, length: int) -> bytes:
+    """Returns the concatenation of the 26-letter substitutions done by the machine at each of the length next
+    keypresses from the given (right-to-left) rotor positions (without building the table of every stepping state)"""
+    static_reflector_table = machine.static_reflector_table(rotor_positions)
+    right_position = rotor_positions[0] - 1
+    segments = stepping_segments(
+        machine.turnover_tables, tuple(position - 1 for position in rotor_positions[:3]), length
+    )
+
+    substitutions = []
+    for start, end, middle_position, left_position in segments:
+        # The middle and left rotors only move from time to time, so their part of the substitution is reused
+        inner_table = inner_substitution(machine, middle_position, left_position, static_reflector_table)
+        for i in range(start, end):
+            position = (right_position + i + 1) % 26
+            exit_table = machine.exit_tables[position] + TRANSLATION_TABLE_PADDING
+            substitutions.append(machine.entry_tables[position].translate(inner_table).translate(exit_table))
+
+    return b"".join(substitutions)
+
+
 class EnigmaI(Enigma):
     """A class representing the Enigma I machine with its rotors I to V and its reflectors A, B and C"""
 
@@ -380,3 +804,213 @@ class EnigmaM4(EnigmaM3):
             starting_positions=starting_positions,
             preserve_non_alphabetic_characters=preserve_non_alphabetic_characters,
         )
+
+
+class EnigmaSettings(NamedTuple):
+    """An immutable and hashable representation of the settings of an Enigma machine (except the starting positions,
+    which are given when encrypting), used as the key of the compiled machines cache"""
+
+    machine_class: type
+    rotors: tuple[str, ...]
+    ring_settings: tuple[int, ...]
+    reflector: str
+    plugboard: tuple[tuple[str, str], ...]
+
+    @classmethod
+    def create(cls, machine_class, rotors, ring_settings, plugboard: dict, reflector: str = "B") -> "EnigmaSettings":
+        """Returns the settings corresponding to the arguments of the machine_class constructor, normalised so that
+        equivalent settings are equal (ring settings as letter indexes with A=1, plugboard connections sorted)"""
+        ring_settings = tuple(
+            letter_index(ring_setting) if isinstance(ring_setting, str) else ring_setting
+            for ring_setting in ring_settings
+        )
+        plugboard = tuple(sorted({tuple(sorted(connection)) for connection in plugboard.items()}))
+        return cls(machine_class, tuple(rotors), ring_settings, reflector, plugboard)
+
+    def machine(self) -> Enigma:
+        """Returns a new machine with these settings"""
+        return self.machine_class(
+            rotors=list(self.rotors),
+            ring_settings=list(self.ring_settings),
+            plugboard=dict(self.plugboard),
+            reflector=self.reflector,
+        )
+
+
+@lru_cache(maxsize=MACHINE_CACHE_SIZE)
+def compiled_machine(settings: EnigmaSettings) -> Enigma:
+    """Returns a compiled machine with the given settings, built only once for each settings (the hits and misses of
+    the cache are given by compiled_machine.cache_info())
+    The machine is shared: the starting positions have to be given to encrypt, and its settings must not be changed
+    (use reentrant_encrypt to share it between threads)"""
+    return settings.machine()
+
+
+@lru_cache(maxsize=None)
+def num_involutions(num_letters: int) -> int:
+    """Returns the number of plugboards (involutions) connecting num_letters letters"""
+    if num_letters <= 1:
+        return 1
+    return num_involutions(num_letters - 1) + (num_letters - 1) * num_involutions(num_letters - 2)
+
+
+def plugboard_rank(plugboard: dict) -> int:
+    """Returns the rank of a plugboard among all the plugboards (a number between 0 and num_involutions(26) - 1)
+    A letter connected to itself (ex: {"A": "A"}) is left unconnected, like on the machine"""
+    for key, value in plugboard.items():
+        if not {key, value} <= set(string.ascii_uppercase):
+            raise ValueError(f"invalid plugboard connection: {key!r} -> {value!r}")
+    plugboard = {key: value for key, value in reciprocal_plugboard(plugboard).items() if key != value}
+    remaining_letters = list(string.ascii_uppercase)
+    rank = 0
+    while remaining_letters:
+        letter = remaining_letters.pop(0)
+        if letter not in plugboard:
+            # The plugboards leaving the letter unconnected come first
+            continue
+        partner = plugboard[letter]
+        partner_index = remaining_letters.index(partner)
+        rank += num_involutions(len(remaining_letters)) + partner_index * num_involutions(len(remaining_letters) - 1)
+        remaining_letters.pop(partner_index)
+    return rank
+
+
+def plugboard_from_rank(rank: int) -> dict:
+    """Returns the plugboard of the given rank (inverse of plugboard_rank), with each connection once"""
+    remaining_letters = list(string.ascii_uppercase)
+    plugboard = {}
+    while remaining_letters:
+        letter = remaining_letters.pop(0)
+        num_unconnected = num_involutions(len(remaining_letters))
+        if rank < num_unconnected:
+            continue
+        partner_index, rank = divmod(rank - num_unconnected, num_involutions(len(remaining_letters) - 1))
+        plugboard[letter] = remaining_letters.pop(partner_index)
+    return plugboard
+
+
+class EnigmaSettingsCodec:
+    """A class used to pack the settings of an Enigma model (rotors, ring settings, reflector, plugboard and optionally
+    starting positions) in a single integer or a fixed-width bytes record, and to unpack them
+    Codes are ordered by rotors, then reflector, ring settings, plugboard and starting positions, so sorting codes
+    groups the settings sharing the same machine"""
+
+    def __init__(self, machine_class=EnigmaI):
+        """Parameters:
+        machine_class: the Enigma model whose settings are packed (EnigmaI, EnigmaM3 or EnigmaM4)
+        """
+        self.machine_class = machine_class
+        rotors = list(machine_class.ROTORS)
+        if hasattr(machine_class, "LEFTMOST_ROTORS"):
+            self.rotor_names = [list(machine_class.LEFTMOST_ROTORS)] + [rotors] * 3
+        else:
+            self.rotor_names = [rotors] * 3
+        self.reflector_names = list(machine_class.REFLECTORS)
+        self.num_rotors = len(self.rotor_names)
+
+        # Radixes of the digits of a code, from the least significant one
+        self.radixes = (
+            [26] * self.num_rotors
+            + [2, num_involutions(26)]
+            + [26] * self.num_rotors
+            + [len(self.reflector_names)]
+            + [len(names) for names in reversed(self.rotor_names)]
+        )
+        self.num_codes = 1
+        for radix in self.radixes:
+            self.num_codes *= radix
+        self.record_size = ((self.num_codes - 1).bit_length() + 7) // 8
+
+    def pack(self, rotors, ring_settings, plugboard: dict, reflector: str = "B", starting_positions=None) -> int:
+        """Returns the code of the given settings (in the same format as the machine_class constructor arguments)"""
+        if len(rotors) != self.num_rotors or len(ring_settings) != self.num_rotors:
+            raise ValueError(f"this Enigma has {self.num_rotors} rotors")
+        if starting_positions is not None and len(starting_positions) != self.num_rotors:
+            raise ValueError(f"this Enigma has {self.num_rotors} rotors")
+        try:
+            rotor_digits = [names.index(rotor) for names, rotor in zip(self.rotor_names, rotors)]
+        except ValueError:
+            raise ValueError(f"invalid rotors {list(rotors)}")
+        try:
+            reflector_digit = self.reflector_names.index(reflector)
+        except ValueError:
+            raise ValueError(f"invalid reflector name '{reflector}'")
+
+        def to_digits(positions) -> list[int]:
+            return [(letter_index(position) if isinstance(position, str) else position) - 1 for position in positions]
+
+        has_positions = starting_positions is not None
+        digits = (
+            list(reversed(to_digits(starting_positions if has_positions else [1] * self.num_rotors)))
+            + [int(has_positions), plugboard_rank(plugboard)]
+            + list(reversed(to_digits(ring_settings)))
+            + [reflector_digit]
+            + list(reversed(rotor_digits))
+        )
+
+        code = 0
+        for digit, radix in zip(reversed(digits), reversed(self.radixes)):
+            if not 0 <= digit < radix:
+                raise ValueError("invalid ring settings or starting positions")
+            code = code * radix + digit
+        return code
+
+    def unpack(self, code: int) -> dict:
+        """Returns the keyword arguments of the machine_class constructor corresponding to a code (starting_positions
+        is None if they weren't packed)"""
+        if not 0 <= code < self.num_codes:
+            raise ValueError("invalid settings code")
+        digits = []
+        for radix in self.radixes:
+            code, digit = divmod(code, radix)
+            digits.append(digit)
+
+        num_rotors = self.num_rotors
+        position_digits = digits[:num_rotors]
+        has_positions, plugboard_code = digits[num_rotors : num_rotors + 2]
+        ring_digits = digits[num_rotors + 2 : 2 * num_rotors + 2]
+        reflector_digit = digits[2 * num_rotors + 2]
+        rotor_digits = digits[2 * num_rotors + 3 :]
+
+        def to_letters(digits: list[int]) -> str:
+            return "".join(letter_from_index(digit + 1) for digit in reversed(digits))
+
+        return {
+            "rotors": [names[digit] for names, digit in zip(self.rotor_names, reversed(rotor_digits))],
+            "ring_settings": to_letters(ring_digits),
+            "plugboard": plugboard_from_rank(plugboard_code),
+            "reflector": self.reflector_names[reflector_digit],
+            "starting_positions": to_letters(position_digits) if has_positions else None,
+        }
+
+    def pack_settings(self, settings: EnigmaSettings, starting_positions=None) -> int:
+        """Returns the code of an EnigmaSettings (of the same model) with the given starting positions"""
+        if settings.machine_class is not self.machine_class:
+            raise ValueError(f"these settings are for {settings.machine_class.__name__}")
+        return self.pack(
+            settings.rotors, settings.ring_settings, dict(settings.plugboard), settings.reflector, starting_positions
+        )
+
+    def unpack_settings(self, code: int) -> tuple[EnigmaSettings, str | None]:
+        """Returns the EnigmaSettings and the starting positions (or None) corresponding to a code"""
+        arguments = self.unpack(code)
+        starting_positions = arguments.pop("starting_positions")
+        return EnigmaSettings.create(self.machine_class, **arguments), starting_positions
+
+    def to_bytes(self, code: int) -> bytes:
+        """Returns a code as a big-endian record of record_size bytes (records sort like the codes)"""
+        return code.to_bytes(self.record_size, "big")
+
+    def from_bytes(self, record: bytes) -> int:
+        """Returns the code stored in a record"""
+        if len(record) != self.record_size:
+            raise ValueError(f"records must have {self.record_size} bytes")
+        return int.from_bytes(record, "big")
+
+    def iter_records(self, buffer: bytes):
+        """Yields the codes stored in a buffer of consecutive records"""
+        if len(buffer) % self.record_size:
+            raise ValueError(f"the buffer length must be a multiple of {self.record_size}")
+        buffer = memoryview(buffer)
+        for start in range(0, len(buffer), self.record_size):
+            yield int.from_bytes(buffer[start : start + self.record_size], "big")
@@ -2,6 +2,14 @@ from InquirerPy.utils import color_print
 import string
 import re
 
+# Translation tables between uppercase letters and 0-based letter indexes (A=0), used by the compiled ciphers
+LETTERS_TO_INDEXES = bytes.maketrans(string.ascii_uppercase.encode(), bytes(range(26)))
+INDEXES_TO_LETTERS = bytes.maketrans(bytes(range(26)), string.ascii_uppercase.encode())
+# Bytes which aren't ASCII letters (removed before encrypting bytes)
+NON_LETTER_BYTES = bytes(byte for byte in range(256) if not chr(byte).isascii() or not chr(byte).isalpha())
+# Translation table giving 1 for the bytes which aren't ASCII letters and 0 for the letters
+NON_LETTER_FLAGS = bytes(int(byte in NON_LETTER_BYTES) for byte in range(256))
+
 
 def to_number_between_1_and_26(letter_index: int) -> int:
     """Converts a letter index to a number between 1 and 26"""
@@ -10,9 +18,54 @@ def to_number_between_1_and_26(letter_index: int) -> int:
 
 def to_upper_case_without_punctuation_or_spaces(text: str) -> str:
     """Changes all the letters to upper case, and removes any character that isn't a letter"""
+    if isinstance(text, NormalizedText):
+        return text
     return re.sub("[^A-Z]", "", text.upper())
 
 
+class NormalizedText(str):
+    """A text normalized once: the string of its uppercase letters (like to_upper_case_without_punctuation_or_spaces
+    returns), which also keeps its letters as 0-based indexes and the original text, so that the ciphers and the
+    cryptanalysis functions given it don't normalize it again"""
+
+    def __new__(cls, text: str):
+        if isinstance(text, NormalizedText):
+            return text
+        if text.isascii():
+            letters = text.encode().upper().translate(LETTERS_TO_INDEXES, NON_LETTER_BYTES)
+            normalized_text = super().__new__(cls, letters.translate(INDEXES_TO_LETTERS).decode())
+        else:
+            normalized_text = super().__new__(cls, re.sub("[^A-Z]", "", text.upper()))
+            letters = normalized_text.encode().translate(LETTERS_TO_INDEXES)
+        normalized_text.letters = letters
+        normalized_text.original_text = text
+        return normalized_text
+
+    @classmethod
+    def from_letters(cls, letters: bytes) -> "NormalizedText":
+        """Returns the text made of the given letters (0-based indexes)"""
+        normalized_text = super().__new__(cls, letters.translate(INDEXES_TO_LETTERS).decode())
+        normalized_text.letters = letters
+        normalized_text.original_text = str(normalized_text)
+        return normalized_text
+
+    def __reduce__(self):
+        return NormalizedText, (self.original_text,)
+
+    def upper_case_bytes(self) -> bytes:
+        """Returns the original text encoded in UTF-8, with its ASCII letters in upper case"""
+        return self.original_text.encode().upper()
+
+    def non_letter_mask(self) -> bytes:
+        """Returns a flag for each byte of upper_case_bytes(): 1 if it isn't an ASCII letter"""
+        return self.original_text.encode().translate(NON_LETTER_FLAGS)
+
+
+def letter_indexes(text: str) -> bytes:
+    """Returns the 0-based indexes of the letters of a text (normalized like to_upper_case_without_punctuation_or_spaces)"""
+    return NormalizedText(text).letters
+
+
 def letter_index(letter: str) -> int:
     """Returns the index in the alphabet of the letter given (with A=1)"""
     return string.ascii_uppercase.index(letter.upper()) + 1
@@ -0,0 +1,170 @@
+from helper_functions import *
+from collections import Counter
+from typing import NamedTuple
+from array import array
+from math import gcd
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional: the n-grams are then indexed one by one
+    np = None
+
+# Number of letters indexed at once (the memory used doesn't depend on the length of the text)
+KASISKI_BLOCK_LENGTH = 1 << 20
+
+# Maximum length of the n-grams indexed (the index has 26^n entries)
+MAX_NGRAM_LENGTH = 5
+
+
+class KasiskiExamination(NamedTuple):
+    """The result of the Kasiski examination of a ciphertext"""
+
+    key_lengths: list[tuple[int, float]]  # (key length, score) pairs, most probable first (a score of 1 is chance)
+    spacing_factor_counts: dict[int, int]  # key length -> number of spacings multiple of it
+    num_spacings: int  # number of spacings between consecutive occurrences of repeated n-grams
+    gcd_counts: Counter  # GCD of the spacings of a repeated n-gram -> number of n-grams with this GCD
+    # (n-gram, number of occurrences, GCD of its spacings), most frequent first
+    most_repeated: list[tuple[str, int, int]]
+
+
+def ngram_from_code(code: int, ngram_length: int) -> str:
+    """Returns the n-gram whose code (its letters as the digits of a base 26 number) is given"""
+    return "".join(letter_from_index((code // 26**power) % 26 + 1) for power in reversed(range(ngram_length)))
+
+
+class NgramIndex:
+    """A class used to index the n-grams of a text block by block: for each n-gram (identified by its rolling code),
+    it keeps its number of occurrences, the position of its last occurrence and the GCD of the spacings between its
+    occurrences, and it counts the spacings multiple of each candidate key length"""
+
+    def __init__(self, ngram_length: int, key_lengths: range):
+        if not 2 <= ngram_length <= MAX_NGRAM_LENGTH:
+            raise ValueError(f"the n-grams must have between 2 and {MAX_NGRAM_LENGTH} letters")
+        self.ngram_length = ngram_length
+        self.key_lengths = key_lengths
+        self.spacing_factor_counts = dict.fromkeys(key_lengths, 0)
+        self.num_spacings = 0
+        num_codes = 26**ngram_length
+        if np is not None:
+            self.counts = np.zeros(num_codes, dtype=np.int64)
+            self.last_positions = np.full(num_codes, -1, dtype=np.int64)
+            self.spacing_gcds = np.zeros(num_codes, dtype=np.int64)
+        else:
+            self.counts = array("q", bytes(8 * num_codes))
+            self.last_positions = array("q", [-1]) * num_codes
+            self.spacing_gcds = array("q", bytes(8 * num_codes))
+
+    def add_block(self, letters: bytes, start: int):
+        """Indexes the n-grams starting in a block of letters (0-based indexes) beginning at the position start
+        (the block has to contain the ngram_length - 1 letters following it)"""
+        num_ngrams = len(letters) - self.ngram_length + 1
+        if num_ngrams <= 0:
+            return
+        if np is None:
+            self.add_block_without_numpy(letters, start, num_ngrams)
+            return
+
+        letters_array = np.frombuffer(letters, dtype=np.uint8).astype(np.int64)
+        codes = np.zeros(num_ngrams, dtype=np.int64)
+        for offset in range(self.ngram_length):
+            codes *= 26
+            codes += letters_array[offset : offset + num_ngrams]
+
+        # Sorting the positions by n-gram gives the consecutive occurrences of each n-gram next to each other
+        order = np.argsort(codes, kind="stable")
+        sorted_codes = codes[order]
+        positions = order + start
+        is_first = np.empty(num_ngrams, dtype=bool)
+        is_first[0] = True
+        np.not_equal(sorted_codes[1:], sorted_codes[:-1], out=is_first[1:])
+        previous_positions = np.empty(num_ngrams, dtype=np.int64)
+        previous_positions[1:] = positions[:-1]
+        previous_positions[is_first] = self.last_positions[sorted_codes[is_first]]
+
+        has_previous = previous_positions >= 0
+        spacings = (positions - previous_positions)[has_previous]
+        np.gcd.at(self.spacing_gcds, sorted_codes[has_previous], spacings)
+        self.counts[sorted_codes[is_first]] += np.diff(np.append(np.flatnonzero(is_first), num_ngrams))
+        is_last = np.append(is_first[1:], True)
+        self.last_positions[sorted_codes[is_last]] = positions[is_last]
+
+        self.num_spacings += len(spacings)
+        # The spacings are counted for each key length, without a table as long as the largest spacing
+        for key_length in self.key_lengths:
+            self.spacing_factor_counts[key_length] += int(np.count_nonzero(spacings % key_length == 0))
+
+    def add_block_without_numpy(self, letters: bytes, start: int, num_ngrams: int):
+        code = 0
+        for letter in letters[: self.ngram_length - 1]:
+            code = code * 26 + letter
+        modulus = 26**self.ngram_length
+        for offset in range(num_ngrams):
+            # The code of the next n-gram is computed from the previous one (rolling code)
+            code = (code * 26 + letters[offset + self.ngram_length - 1]) % modulus
+            position = start + offset
+            self.counts[code] += 1
+            last_position = self.last_positions[code]
+            if last_position >= 0:
+                spacing = position - last_position
+                self.spacing_gcds[code] = gcd(self.spacing_gcds[code], spacing)
+                self.num_spacings += 1
+                for key_length in self.key_lengths:
+                    if spacing % key_length == 0:
+                        self.spacing_factor_counts[key_length] += 1
+            self.last_positions[code] = position
+
+    def examination(self, num_most_repeated: int) -> KasiskiExamination:
+        """Returns the results of the examination of the blocks added"""
+        key_lengths = [
+            (key_length, count * key_length / self.num_spacings if self.num_spacings else 0.0)
+            for key_length, count in self.spacing_factor_counts.items()
+        ]
+        key_lengths.sort(key=lambda candidate: -candidate[1])
+
+        if np is not None:
+            repeated_codes = np.flatnonzero(self.counts > 1)
+            gcd_counts = Counter(self.spacing_gcds[repeated_codes].tolist())
+            most_repeated_codes = repeated_codes[np.argsort(-self.counts[repeated_codes], kind="stable")]
+            most_repeated_codes = most_repeated_codes[:num_most_repeated].tolist()
+        else:
+            repeated_codes = [code for code, count in enumerate(self.counts) if count > 1]
+            gcd_counts = Counter(self.spacing_gcds[code] for code in repeated_codes)
+            most_repeated_codes = sorted(repeated_codes, key=lambda code: -self.counts[code])[:num_most_repeated]
+        most_repeated = [
+            (ngram_from_code(code, self.ngram_length), int(self.counts[code]), int(self.spacing_gcds[code]))
+            for code in most_repeated_codes
+        ]
+        return KasiskiExamination(key_lengths, self.spacing_factor_counts, self.num_spacings, gcd_counts, most_repeated)
+
+
+def kasiski_examination(
+    text: str,
+    min_len: int = 2,
+    max_len: int = 20,
+    ngram_length: int = 3,
+    num_most_repeated: int = 10,
+    block_length: int = KASISKI_BLOCK_LENGTH,
+) -> KasiskiExamination:
+    """Takes a ciphertext encrypted with the Vigenere cipher, finds the n-grams repeated in it, and ranks the key
+    lengths within the interval specified by how many spacings between their occurrences are multiples of them
+
+    Optional:
+    min_len, max_len: the interval of the key lengths ranked
+    ngram_length: the length of the repeated n-grams looked for (defaults to 3)
+    num_most_repeated: the number of most repeated n-grams returned
+    block_length: the number of letters indexed at once
+    """
+    letters = letter_indexes(text)
+    index = NgramIndex(ngram_length, range(min_len, max_len + 1))
+    for start in range(0, max(len(letters) - ngram_length + 1, 0), block_length):
+        index.add_block(letters[start : start + block_length + ngram_length - 1], start)
+    return index.examination(num_most_repeated)
+
+
+def kasiski_key_lengths(text: str, min_len: int = 2, max_len: int = 20, ngram_length: int = 3) -> list[int]:
+    """Returns the key lengths within the interval specified ranked by the Kasiski examination (most probable first),
+    or an empty list if no n-gram is repeated"""
+    examination = kasiski_examination(text, min_len, max_len, ngram_length, num_most_repeated=0)
+    if not examination.num_spacings:
+        return []
+    return [key_length for key_length, _ in examination.key_lengths]
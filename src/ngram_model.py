@@ -0,0 +1,339 @@
+from cryptanalysis_frequencies import LETTER_FRENQUENCIES, MOST_COMMON_BIGRAMS, MOST_COMMON_TRIGRAMS
+from helper_functions import *
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from array import array
+import unicodedata
+import argparse
+import json
+import math
+import mmap
+import os
+import struct
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional: the n-grams are then looked up one by one
+    np = None
+
+# A model file starts with this magic, the length of its JSON header and the header itself, followed (at a multiple
+# of 8) by the tables of the 1-grams to the max_ngram_length-grams: 26^n log10 probabilities each (4 bytes floats),
+# indexed by the n-gram code (its letters as the digits of a base 26 number, with A=0)
+MODEL_MAGIC = b"NGRAMLPM"
+MAX_NGRAM_LENGTH = 4
+
+# The model loaded by english_model if this file exists (see build_language_model)
+ENGLISH_MODEL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "english_ngrams.bin")
+
+# Number of characters of a corpus read and counted at once by build_language_model
+CORPUS_CHUNK_SIZE = 1 << 22
+
+
+def ngram_codes(letters: bytes, ngram_length: int):
+    """Returns the codes of the n-grams of letters (0-based indexes), computed by rolling from one n-gram to the next
+    (as a NumPy array, or a list without NumPy)"""
+    num_ngrams = len(letters) - ngram_length + 1
+    if num_ngrams <= 0:
+        return np.zeros(0, dtype=np.int64) if np is not None else []
+    if np is not None:
+        letters_array = np.frombuffer(letters, dtype=np.uint8)
+        codes = letters_array[:num_ngrams].astype(np.int64)
+        for offset in range(1, ngram_length):
+            codes *= 26
+            codes += letters_array[offset : offset + num_ngrams]
+        return codes
+    modulus = 26**ngram_length
+    code = 0
+    for letter in letters[: ngram_length - 1]:
+        code = code * 26 + letter
+    codes = []
+    for letter in letters[ngram_length - 1 :]:
+        code = (code * 26 + letter) % modulus
+        codes.append(code)
+    return codes
+
+
+def table_sum(letters: bytes, table, ngram_length: int) -> float:
+    """Returns the sum of the values of table (indexed by n-gram code) for every n-gram of letters (0-based indexes)"""
+    if np is not None:
+        return float(np.asarray(table)[ngram_codes(letters, ngram_length)].sum(dtype=np.float64))
+    return math.fsum(table[code] for code in ngram_codes(letters, ngram_length))
+
+
+def frequency_table(frequencies: dict) -> list[float]:
+    """Returns the values of a dictionary n-gram -> value in a list indexed by n-gram code (0 for the n-grams missing)"""
+    ngram_length = len(next(iter(frequencies)))
+    table = [0.0] * 26**ngram_length
+    for ngram, frequency in frequencies.items():
+        code = 0
+        for letter in ngram:
+            code = code * 26 + letter_index(letter) - 1
+        table[code] = frequency
+    return table
+
+
+class NgramModel:
+    """A language model giving the log10 probability of every n-gram (of 1 to max_ngram_length letters), stored in flat
+    tables indexed by n-gram code, so that scoring a text is one table lookup per n-gram"""
+
+    def __init__(self, tables: list, language: str = ""):
+        """Parameters:
+        tables: the tables of the 1-grams, 2-grams... (26^n log10 probabilities each, indexed by n-gram code)
+
+        Optional:
+        language: the name of the language of the model
+        """
+        if not 1 <= len(tables) <= MAX_NGRAM_LENGTH:
+            raise ValueError(f"a model has tables for 1 to {MAX_NGRAM_LENGTH} letters")
+        for ngram_length, table in enumerate(tables, 1):
+            if len(table) != 26**ngram_length:
+                raise ValueError(f"the table of the {ngram_length}-grams must have {26 ** ngram_length} entries")
+        self.tables = tables
+        self.language = language
+        self.max_ngram_length = len(tables)
+        self.memory_map = None
+        self.memory_view = None
+
+    @classmethod
+    def from_counts(cls, counts: list, language: str = ""):
+        """Returns the model estimated from the number of occurrences of the n-grams in a corpus (a list indexed by
+        n-gram code for each length); the n-grams never seen get the probability of half an occurrence"""
+        tables = []
+        for ngram_counts in counts:
+            total = sum(ngram_counts) if np is None else int(np.sum(ngram_counts))
+            if not total:
+                raise ValueError("the corpus doesn't contain any n-gram of this length")
+            log_total = math.log10(total)
+            if np is not None:
+                log_counts = np.log10(np.maximum(np.asarray(ngram_counts, dtype=np.float64), 0.5))
+                tables.append((log_counts - log_total).astype(np.float32))
+            else:
+                tables.append(array("f", (math.log10(max(count, 0.5)) - log_total for count in ngram_counts)))
+        return cls(tables, language)
+
+    @classmethod
+    def from_frequencies(cls, frequencies: list[dict], language: str = ""):
+        """Returns the model given by tables of frequencies (dictionaries n-gram -> percentage, for 1-grams, 2-grams...)
+        which may only list the most common n-grams: the remaining probability is shared between the other n-grams
+        in proportion to the product of the probabilities of their letters"""
+        letter_probabilities = frequency_table(frequencies[0])
+        total = sum(letter_probabilities)
+        letter_probabilities = [probability / total for probability in letter_probabilities]
+        tables = []
+        for ngram_length, ngram_frequencies in enumerate(frequencies, 1):
+            listed = frequency_table(ngram_frequencies)
+            independent = [1.0]
+            for _ in range(ngram_length):
+                independent = [probability * letter for probability in independent for letter in letter_probabilities]
+            remaining_probability = max(1 - sum(listed) / 100, 0.01)
+            remaining_independent = sum(
+                probability for probability, frequency in zip(independent, listed) if not frequency
+            )
+            scale = remaining_probability / remaining_independent if remaining_independent else 0
+            tables.append(
+                array(
+                    "f",
+                    (
+                        math.log10(frequency / 100 if frequency else probability * scale)
+                        for probability, frequency in zip(independent, listed)
+                    ),
+                )
+            )
+        return cls(tables, language)
+
+    @classmethod
+    def load(cls, file_path: str):
+        """Returns the model of a model file, whose tables are memory-mapped (not read in memory)"""
+        with open(file_path, "rb") as file:
+            memory_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if memory_map[: len(MODEL_MAGIC)] != MODEL_MAGIC:
+            memory_map.close()
+            raise ValueError("invalid model file")
+        (header_length,) = struct.unpack_from("<I", memory_map, len(MODEL_MAGIC))
+        header_start = len(MODEL_MAGIC) + 4
+        header = json.loads(memory_map[header_start : header_start + header_length])
+
+        start = header_start + header_length
+        lengths = range(1, header["max_ngram_length"] + 1)
+        if start + sum(4 * 26**ngram_length for ngram_length in lengths) > len(memory_map):
+            memory_map.close()
+            raise ValueError("truncated model file")
+        tables = []
+        view = memoryview(memory_map)
+        for ngram_length in lengths:
+            end = start + 4 * 26**ngram_length
+            if np is not None:
+                tables.append(np.frombuffer(memory_map, dtype="<f4", count=26**ngram_length, offset=start))
+            else:
+                tables.append(view[start:end].cast("f"))
+            start = end
+        model = cls(tables, header.get("language", ""))
+        model.memory_map = memory_map
+        model.memory_view = view
+        return model
+
+    def save(self, file_path: str):
+        """Writes the model to a model file"""
+        header = json.dumps({"language": self.language, "max_ngram_length": self.max_ngram_length}).encode()
+        header += b" " * (-(len(MODEL_MAGIC) + 4 + len(header)) % 8)
+        with open(file_path, "wb") as file:
+            file.write(MODEL_MAGIC + struct.pack("<I", len(header)) + header)
+            for table in self.tables:
+                file.write(struct.pack(f"<{len(table)}f", *table))
+
+    def table(self, ngram_length: int):
+        """Returns the table of the log10 probabilities of the n-grams of the given length"""
+        if not 1 <= ngram_length <= self.max_ngram_length:
+            raise ValueError(f"the model only has n-grams of 1 to {self.max_ngram_length} letters")
+        return self.tables[ngram_length - 1]
+
+    def log_probability(self, text: str, ngram_length: int = None) -> float:
+        """Returns the sum of the log10 probabilities of the n-grams of a text (the longest n-grams by default)"""
+        ngram_length = ngram_length or self.max_ngram_length
+        return table_sum(letter_indexes(text), self.table(ngram_length), ngram_length)
+
+    def score(self, text: str, ngram_length: int = None) -> float:
+        """Returns the mean log10 probability of the n-grams of a text (the longest n-grams by default, or the longest
+        the text contains if it is shorter), or -inf for a text without letters"""
+        letters = letter_indexes(text)
+        ngram_length = min(ngram_length or self.max_ngram_length, len(letters))
+        if not ngram_length:
+            return -math.inf
+        return table_sum(letters, self.table(ngram_length), ngram_length) / (len(letters) - ngram_length + 1)
+
+    def close(self):
+        """Closes the memory map of a model loaded from a file (the model can't be used afterwards)
+        The tables of such a model are views of the memory map: the ones given by table() must not be kept after the
+        model is closed, and a ValueError is raised if one is still referenced (with or without NumPy)
+        If the model is the one shared by english_model, the next call to english_model loads it again"""
+        if self.memory_map is None:
+            return
+        # The tables are only released when they aren't referenced anymore, so a table kept by the caller still
+        # prevents the memory map from being closed
+        self.tables = []
+        self.memory_view.release()
+        try:
+            self.memory_map.close()
+        except BufferError:
+            raise ValueError("a table of the model is still referenced") from None
+        self.memory_map = None
+        if english_model.cache_info().currsize and english_model() is self:
+            english_model.cache_clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+@lru_cache(maxsize=None)
+def english_model() -> NgramModel:
+    """Returns the English model: the one of ENGLISH_MODEL_FILE if it exists, or the one given by the frequencies of
+    cryptanalysis_frequencies otherwise (up to trigrams)"""
+    if os.path.exists(ENGLISH_MODEL_FILE):
+        return NgramModel.load(ENGLISH_MODEL_FILE)
+    return NgramModel.from_frequencies([LETTER_FRENQUENCIES, MOST_COMMON_BIGRAMS, MOST_COMMON_TRIGRAMS], "english")
+
+
+def corpus_letters(file_paths: list[str], chunk_size: int = CORPUS_CHUNK_SIZE, overlap: int = 0):
+    """Yields the letters (0-based indexes) of corpus files chunk by chunk, each chunk preceded by the overlap last
+    letters of the previous chunk of the same file, as (letters, number of letters repeated) pairs
+    The accents are removed (ex: É -> E) and the other characters which aren't letters A to Z are ignored"""
+    for file_path in file_paths:
+        previous_letters = b""
+        with open(file_path, encoding="utf-8", errors="replace") as file:
+            while chunk := file.read(chunk_size):
+                letters = letter_indexes(unicodedata.normalize("NFKD", chunk))
+                if letters:
+                    yield previous_letters + letters, len(previous_letters)
+                    previous_letters = (previous_letters + letters)[-overlap:] if overlap else b""
+
+
+def count_ngrams(letters: bytes, num_repeated: int, max_ngram_length: int) -> list:
+    """Returns the number of occurrences of each n-gram (indexed by n-gram code) of 1 to max_ngram_length letters in
+    a chunk of letters (0-based indexes) whose first num_repeated letters were already counted with the previous chunk
+    """
+    counts = []
+    for ngram_length in range(1, max_ngram_length + 1):
+        # The n-grams ending in the repeated letters were counted with the previous chunk
+        codes = ngram_codes(letters[max(num_repeated - ngram_length + 1, 0) :], ngram_length)
+        if np is not None:
+            counts.append(np.bincount(codes, minlength=26**ngram_length))
+        else:
+            ngram_counts = [0] * 26**ngram_length
+            for code in codes:
+                ngram_counts[code] += 1
+            counts.append(ngram_counts)
+    return counts
+
+
+def build_language_model(
+    corpus_files: list[str],
+    output_file: str,
+    max_ngram_length: int = MAX_NGRAM_LENGTH,
+    language: str = "",
+    max_workers: int = None,
+    chunk_size: int = CORPUS_CHUNK_SIZE,
+) -> NgramModel:
+    """Counts the n-grams of 1 to max_ngram_length letters of a corpus, and writes the corresponding model file
+    (see NgramModel.from_counts); returns the model
+
+    Parameters:
+    corpus_files: the text files of the corpus (UTF-8)
+    output_file: the model file to write
+
+    Optional:
+    max_ngram_length: the length of the longest n-grams (defaults to 4)
+    language: the name of the language of the model
+    max_workers: the number of processes counting the chunks
+    chunk_size: the number of characters read at once (only a few chunks are kept in memory at the same time,
+    whatever the size of the corpus)
+    """
+    if not 1 <= max_ngram_length <= MAX_NGRAM_LENGTH:
+        raise ValueError(f"a model has tables for 1 to {MAX_NGRAM_LENGTH} letters")
+    counts = [[0] * 26**ngram_length for ngram_length in range(1, max_ngram_length + 1)]
+    if np is not None:
+        counts = [np.zeros(26**ngram_length, dtype=np.int64) for ngram_length in range(1, max_ngram_length + 1)]
+
+    def add_counts(chunk_counts: list):
+        for ngram_length, ngram_counts in enumerate(chunk_counts):
+            if np is not None:
+                counts[ngram_length] += ngram_counts
+            else:
+                counts[ngram_length] = [total + count for total, count in zip(counts[ngram_length], ngram_counts)]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # The number of chunks waiting to be counted is bounded, so that the corpus isn't read faster than it's counted
+        max_pending = 2 * (max_workers or os.cpu_count() or 1)
+        pending = []
+        for letters, num_repeated in corpus_letters(corpus_files, chunk_size, max_ngram_length - 1):
+            pending.append(executor.submit(count_ngrams, letters, num_repeated, max_ngram_length))
+            if len(pending) >= max_pending:
+                add_counts(pending.pop(0).result())
+        for future in pending:
+            add_counts(future.result())
+
+    model = NgramModel.from_counts(counts, language)
+    model.save(output_file)
+    return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build an n-gram language model from a corpus of text files")
+    parser.add_argument("corpus_files", nargs="+", help="the text files of the corpus (UTF-8)")
+    parser.add_argument("--output", "-o", required=True, help="the model file to write")
+    parser.add_argument("--max-ngram-length", type=int, default=MAX_NGRAM_LENGTH)
+    parser.add_argument("--language", default="")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=CORPUS_CHUNK_SIZE)
+    arguments = parser.parse_args()
+    model = build_language_model(
+        arguments.corpus_files,
+        arguments.output,
+        arguments.max_ngram_length,
+        arguments.language,
+        arguments.workers,
+        arguments.chunk_size,
+    )
+    print(f"{model.max_ngram_length}-gram model written to {arguments.output}")
@@ -0,0 +1,414 @@
+from cryptanalysis_classical_ciphers import AFFINE_A_COEFFICIENTS, english_score, break_vigenere
+from classical_ciphers import decrypt_caesar, decrypt_affine, decrypt_vigenere
+from enigma_machine import EnigmaI, EnigmaM3, EnigmaSettings, compiled_machine
+from index_of_coincidence import index_of_coincidence
+from helper_functions import *
+from multiprocessing import Process
+from collections import deque
+import socketserver
+import itertools
+import threading
+import argparse
+import hashlib
+import socket
+import heapq
+import json
+import time
+import os
+
+# Number of seconds after which a shard whose worker stopped sending heartbeats is given to another worker
+LEASE_TIMEOUT = 30
+
+# Number of seconds a worker waits before asking again for a shard when none is available
+WAIT_INTERVAL = 0.5
+
+SEARCH_MACHINES = {"EnigmaI": EnigmaI, "EnigmaM3": EnigmaM3}
+
+
+def caesar_key(search: dict, key_index: int):
+    """Returns the Caesar shift number key_index (from 1 to 25)"""
+    return key_index + 1
+
+
+def caesar_score(search: dict, key) -> float:
+    return english_score(decrypt_caesar(search["text"], key))
+
+
+def affine_key(search: dict, key_index: int):
+    """Returns the (a, b) coefficients number key_index"""
+    return [AFFINE_A_COEFFICIENTS[key_index // 26], key_index % 26]
+
+
+def affine_score(search: dict, key) -> float:
+    return english_score(decrypt_affine(search["text"], *key))
+
+
+def vigenere_key(search: dict, key_index: int):
+    """Returns the most probable key whose length is the key length number key_index (found by break_vigenere)"""
+    return break_vigenere(search["text"], search.get("min_key_length", 1) + key_index)
+
+
+def vigenere_score(search: dict, key) -> float:
+    return english_score(decrypt_vigenere(search["text"], key))
+
+
+def enigma_rotor_orders(search: dict) -> list[tuple]:
+    return list(itertools.permutations(SEARCH_MACHINES[search.get("machine", "EnigmaI")].ROTORS, 3))
+
+
+def enigma_key(search: dict, key_index: int):
+    """Returns the [rotor order, starting positions] number key_index"""
+    rotor_order_index, position_index = divmod(key_index, 26**3)
+    starting_positions = "".join(letter_from_index((position_index // 26**power) % 26 + 1) for power in (2, 1, 0))
+    return [list(enigma_rotor_orders(search)[rotor_order_index]), starting_positions]
+
+
+def enigma_score(search: dict, key) -> float:
+    """Returns the index of coincidence of the text decrypted with the given rotor order and starting positions
+    (like phase 1 of cryptanalysis_enigma.ciphertext_only_attack)"""
+    rotor_order, starting_positions = key
+    settings = EnigmaSettings.create(
+        SEARCH_MACHINES[search.get("machine", "EnigmaI")],
+        rotor_order,
+        search.get("ring_settings", "AAA"),
+        {},
+        search.get("reflector", "B"),
+    )
+    return index_of_coincidence(compiled_machine(settings).decrypt(search["text"], starting_positions))
+
+
+# The searches which can be distributed: name -> (function giving the size of the key space, function giving the key
+# number key_index, function scoring a key)
+SEARCHES = {
+    "caesar": (lambda search: 25, caesar_key, caesar_score),
+    "affine": (lambda search: 26 * len(AFFINE_A_COEFFICIENTS), affine_key, affine_score),
+    "vigenere": (
+        lambda search: search.get("max_key_length", 8) - search.get("min_key_length", 1) + 1,
+        vigenere_key,
+        vigenere_score,
+    ),
+    "enigma": (lambda search: len(enigma_rotor_orders(search)) * 26**3, enigma_key, enigma_score),
+}
+
+
+def key_space_size(search: dict) -> int:
+    """Returns the number of keys of a search"""
+    try:
+        size_function, _, _ = SEARCHES[search["name"]]
+    except KeyError:
+        raise ValueError(f"unknown search '{search.get('name')}'")
+    return size_function(search)
+
+
+def num_shards(search: dict) -> int:
+    """Returns the number of shards of a search (the keys are split in shards of search["shard_size"] keys)"""
+    shard_size = search.get("shard_size", 1)
+    return (key_space_size(search) + shard_size - 1) // shard_size
+
+
+def search_shard(search: dict, shard: int) -> list[list]:
+    """Tries every key of a shard and returns the search["top_k"] best ones as [score, key] lists, best first"""
+    _, key_function, score_function = SEARCHES[search["name"]]
+    shard_size = search.get("shard_size", 1)
+    start = shard * shard_size
+    end = min(start + shard_size, key_space_size(search))
+    results = []
+    for key_index in range(start, end):
+        key = key_function(search, key_index)
+        results.append([score_function(search, key), key])
+    return heapq.nlargest(search.get("top_k", 10), results, key=lambda result: result[0])
+
+
+def search_fingerprint(search: dict) -> str:
+    """Returns a hash identifying a search, stored in the checkpoints so that they aren't resumed by another search"""
+    return hashlib.sha256(json.dumps(search, sort_keys=True).encode()).hexdigest()
+
+
+def send_message(file, message: dict):
+    file.write(json.dumps(message).encode() + b"\n")
+    file.flush()
+
+
+def receive_message(file) -> dict | None:
+    """Returns the next message received, or None if the connection is closed"""
+    line = file.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+class SearchCoordinator:
+    """A class used to distribute the shards of a search to workers connecting through a socket, and to merge their
+    results in a checkpoint file
+    When no shard is left, idle workers also search the shards given the longest time ago (the first result received
+    is kept). The shards of a worker which disconnects or stops sending heartbeats are given again to other workers"""
+
+    def __init__(
+        self,
+        search: dict,
+        checkpoint_file: str = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        lease_timeout: float = LEASE_TIMEOUT,
+    ):
+        """Parameters:
+        search: the search, as a JSON-serialisable dict with its "name" (a key of SEARCHES), the "text" to break,
+        the "shard_size" and the number "top_k" of results kept, and the options of the search
+
+        Optional:
+        checkpoint_file: a JSON file where the shards searched and the best results are saved after each shard
+        host, port: the address to listen to (defaults to a free port on localhost)
+        lease_timeout: the number of seconds after which a shard without heartbeat is given to another worker
+        """
+        self.search = search
+        self.checkpoint_file = checkpoint_file
+        self.lease_timeout = lease_timeout
+        self.num_shards = num_shards(search)
+        self.fingerprint = search_fingerprint(search)
+
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.done_shards = set()
+        self.results = []
+        self.load_checkpoint()
+        self.pending_shards = deque(shard for shard in range(self.num_shards) if shard not in self.done_shards)
+        # Shards being searched: shard -> {worker id: time of the last heartbeat}
+        self.leases = {}
+        self.worker_ids = itertools.count()
+        if len(self.done_shards) == self.num_shards:
+            self.finished.set()
+
+        coordinator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                coordinator.handle_worker(self.rfile, self.wfile)
+
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler, bind_and_activate=False)
+        self.server.daemon_threads = True
+        self.server.allow_reuse_address = True
+        self.server.server_bind()
+        self.server.server_activate()
+        self.address = self.server.server_address
+
+    def load_checkpoint(self):
+        if self.checkpoint_file is None or not os.path.exists(self.checkpoint_file):
+            return
+        with open(self.checkpoint_file) as file:
+            checkpoint = json.load(file)
+        if checkpoint["fingerprint"] != self.fingerprint:
+            raise ValueError("the checkpoint file was written by another search")
+        self.done_shards = set(checkpoint["done_shards"])
+        self.results = checkpoint["results"]
+
+    def save_checkpoint(self):
+        """Saves the shards searched and the best results (the file is replaced atomically)"""
+        if self.checkpoint_file is None:
+            return
+        checkpoint = {
+            "fingerprint": self.fingerprint,
+            "search": self.search,
+            "done_shards": sorted(self.done_shards),
+            "results": self.results,
+        }
+        temporary_file = self.checkpoint_file + ".tmp"
+        with open(temporary_file, "w") as file:
+            json.dump(checkpoint, file)
+        os.replace(temporary_file, self.checkpoint_file)
+
+    def release_expired_leases(self):
+        """Gives the shards whose workers stopped sending heartbeats to the next workers (called with the lock held)"""
+        now = time.monotonic()
+        for shard, workers in list(self.leases.items()):
+            for worker_id, last_heartbeat in list(workers.items()):
+                if now - last_heartbeat > self.lease_timeout:
+                    del workers[worker_id]
+            if not workers:
+                del self.leases[shard]
+                self.pending_shards.appendleft(shard)
+
+    def assign_shard(self, worker_id: int) -> int | None:
+        """Returns the shard the worker has to search next, or None if there is none (called with the lock held)"""
+        self.release_expired_leases()
+        while self.pending_shards:
+            shard = self.pending_shards.popleft()
+            if shard not in self.done_shards:
+                self.leases.setdefault(shard, {})[worker_id] = time.monotonic()
+                return shard
+
+        # Work stealing: the shard searched by the fewest workers, for the longest time, is also given to this worker
+        stealable_shards = [shard for shard, workers in self.leases.items() if worker_id not in workers]
+        if not stealable_shards:
+            return None
+        shard = min(stealable_shards, key=lambda shard: (len(self.leases[shard]), min(self.leases[shard].values())))
+        self.leases[shard][worker_id] = time.monotonic()
+        return shard
+
+    def record_results(self, worker_id: int, shard: int, results: list[list]):
+        """Merges the results of a shard (called with the lock held)"""
+        self.leases.get(shard, {}).pop(worker_id, None)
+        if shard in self.done_shards:
+            return
+        self.done_shards.add(shard)
+        self.leases.pop(shard, None)
+        self.results = heapq.nlargest(
+            self.search.get("top_k", 10), self.results + results, key=lambda result: result[0]
+        )
+        self.save_checkpoint()
+        if len(self.done_shards) == self.num_shards:
+            self.finished.set()
+
+    def release_worker(self, worker_id: int):
+        """Gives back the shards of a disconnected worker (called with the lock held)"""
+        for shard, workers in list(self.leases.items()):
+            if workers.pop(worker_id, None) is not None and not workers:
+                del self.leases[shard]
+                if shard not in self.done_shards:
+                    self.pending_shards.appendleft(shard)
+
+    def handle_worker(self, input_file, output_file):
+        """Answers the messages of a worker until it disconnects"""
+        with self.lock:
+            worker_id = next(self.worker_ids)
+        try:
+            while (message := receive_message(input_file)) is not None:
+                with self.lock:
+                    if message["type"] == "heartbeat":
+                        for workers in self.leases.values():
+                            if worker_id in workers:
+                                workers[worker_id] = time.monotonic()
+                        continue
+                    if message["type"] == "result":
+                        self.record_results(worker_id, message["shard"], message["results"])
+                    if self.finished.is_set():
+                        reply = {"type": "done"}
+                    else:
+                        shard = self.assign_shard(worker_id)
+                        if shard is None:
+                            reply = {"type": "wait"}
+                        else:
+                            reply = {
+                                "type": "shard",
+                                "search": self.search,
+                                "shard": shard,
+                                "lease_timeout": self.lease_timeout,
+                            }
+                send_message(output_file, reply)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            with self.lock:
+                self.release_worker(worker_id)
+
+    def start(self):
+        """Starts answering the workers in a background thread"""
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def wait(self, timeout: float = None) -> list[list]:
+        """Waits for every shard to be searched (or for the timeout), stops the server and returns the best results
+        as [score, key] lists, best first"""
+        self.finished.wait(timeout)
+        self.server.shutdown()
+        self.server.server_close()
+        with self.lock:
+            return list(self.results)
+
+
+def run_worker(host: str, port: int) -> int:
+    """Connects to a coordinator, searches the shards it gives until the search is finished, and returns the number
+    of shards searched (heartbeats are sent three times per lease timeout of the coordinator, given with the shards)"""
+    num_searched_shards = 0
+    with socket.create_connection((host, port)) as connection:
+        input_file = connection.makefile("rb")
+        output_file = connection.makefile("wb")
+        write_lock = threading.Lock()
+        stopped = threading.Event()
+
+        heartbeat_thread = None
+
+        def send_heartbeats(lease_timeout: float):
+            while not stopped.wait(lease_timeout / 3):
+                with write_lock:
+                    send_message(output_file, {"type": "heartbeat"})
+
+        try:
+            message = {"type": "request"}
+            while True:
+                with write_lock:
+                    send_message(output_file, message)
+                reply = receive_message(input_file)
+                if reply is None or reply["type"] == "done":
+                    break
+                if reply["type"] == "wait":
+                    time.sleep(WAIT_INTERVAL)
+                    message = {"type": "request"}
+                    continue
+                if heartbeat_thread is None:
+                    heartbeat_thread = threading.Thread(
+                        target=send_heartbeats, args=(reply.get("lease_timeout", LEASE_TIMEOUT),), daemon=True
+                    )
+                    heartbeat_thread.start()
+                results = search_shard(reply["search"], reply["shard"])
+                message = {"type": "result", "shard": reply["shard"], "results": results}
+                num_searched_shards += 1
+        except (ConnectionError, BrokenPipeError):
+            pass
+        finally:
+            stopped.set()
+    return num_searched_shards
+
+
+def distributed_search(
+    search: dict,
+    num_workers: int = None,
+    checkpoint_file: str = None,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    timeout: float = None,
+    lease_timeout: float = LEASE_TIMEOUT,
+) -> list[list]:
+    """Runs a search with a coordinator and num_workers local worker processes (defaults to the number of CPUs),
+    and returns the best results as [score, key] lists, best first
+    Other workers can join by running 'python search_coordinator.py worker HOST PORT'"""
+    coordinator = SearchCoordinator(search, checkpoint_file, host, port, lease_timeout)
+    coordinator.start()
+    host, port = coordinator.address
+    workers = [Process(target=run_worker, args=(host, port), daemon=True) for _ in range(num_workers or os.cpu_count())]
+    for worker in workers:
+        worker.start()
+    results = coordinator.wait(timeout)
+    for worker in workers:
+        worker.join(WAIT_INTERVAL * 2)
+        if worker.is_alive():
+            worker.terminate()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distributed key-space search")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    coordinator_parser = subparsers.add_parser("coordinator", help="distribute a search to the workers")
+    coordinator_parser.add_argument("search", help="the search, as a JSON object")
+    coordinator_parser.add_argument("--host", default="127.0.0.1")
+    coordinator_parser.add_argument("--port", type=int, default=0)
+    coordinator_parser.add_argument("--checkpoint")
+    coordinator_parser.add_argument("--lease-timeout", type=float, default=LEASE_TIMEOUT)
+    coordinator_parser.add_argument("--workers", type=int, default=None, help="number of local workers started")
+    worker_parser = subparsers.add_parser("worker", help="search the shards given by a coordinator")
+    worker_parser.add_argument("host")
+    worker_parser.add_argument("port", type=int)
+    arguments = parser.parse_args()
+
+    if arguments.command == "coordinator":
+        results = distributed_search(
+            json.loads(arguments.search),
+            arguments.workers,
+            arguments.checkpoint,
+            arguments.host,
+            arguments.port,
+            lease_timeout=arguments.lease_timeout,
+        )
+        for score, key in results:
+            print(score, key)
+    else:
+        print(run_worker(arguments.host, arguments.port), "shards searched")